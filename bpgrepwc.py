@@ -0,0 +1,226 @@
+import sys
+from os import wait4, cpu_count, WIFSIGNALED, WTERMSIG, WEXITSTATUS
+from os.path import abspath, dirname, join, getsize
+from json import dump, load
+from time import time, strftime
+from shutil import rmtree
+from platform import platform, python_version
+from tempfile import mkdtemp
+from statistics import median
+from subprocess import Popen, DEVNULL
+from shlex import split as shell_split
+from typing import Dict, List, Tuple, Union
+from argparse import ArgumentParser
+
+from colorama import Fore, Style, init
+
+from gerar_ficheiro import gerar, parse_size
+
+# pgrepwc.py na mesma diretoria que este programa
+PGREPWC = join(dirname(abspath(__file__)), 'pgrepwc.py')
+
+# Opções do pgrepwc de cada modo
+MODES = { 'c': ['-c'], 'l': ['-l'], 'ac': ['-a', '-c'], 'al': ['-a', '-l'] }
+
+def parse() -> Dict[str, Union[str, int, float, List[str], List[int]]]:
+    """
+    Define o parser de argumentos.
+
+    :return: Dict com valores dos argumentos escolhidos pelo utilizador.
+    """
+    default_p = [ 0 ] + [ 2 ** i for i in range(cpu_count().bit_length()) ]
+
+    parser = ArgumentParser(description='Mede o desempenho do pgrepwc com vários níveis de paralelização, \
+                                            quantidades de palavras e modos (-c, -l, -a -c, -a -l), e guarda \
+                                            os resultados num ficheiro JSON.')
+
+    parser.add_argument('-f', '--files', nargs='+',
+                        help='Ficheiros pesquisados. Por omissão, são gerados ficheiros temporários com o gerar_ficheiro.py \
+                            (ver --size), tantos quanto o maior nível de paralelização.')
+
+    parser.add_argument('--size', type=parse_size, default=parse_size('64M'),
+                        help='Tamanho total dos ficheiros gerados, em bytes, com sufixo K, M ou G opcional. Por omissão, 64M.')
+
+    parser.add_argument('-p', '--parallelization', type=int, nargs='+', default=default_p,
+                        help=f'Níveis de paralelização medidos. Por omissão, {" ".join(map(str, default_p))}.')
+
+    parser.add_argument('-w', '--words', nargs='+', default=['batatas', 'milho', 'antonio'],
+                        help='Palavras pesquisadas. Por omissão, batatas milho antonio.')
+
+    parser.add_argument('-k', '--word-counts', type=int, nargs='+', default=[1, 3],
+                        help='Quantidades de palavras medidas (as primeiras de -w). Por omissão, 1 3.')
+
+    parser.add_argument('-m', '--modes', nargs='+', choices=MODES, default=list(MODES),
+                        help='Modos medidos: c (-c), l (-l), ac (-a -c) e al (-a -l). Por omissão, todos.')
+
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Quantidade de execuções de cada medição (é usada a mediana do tempo). Por omissão, 3.')
+
+    parser.add_argument('-a', '--args', default='',
+                        help='Argumentos do pgrepwc acrescentados a todas as execuções (e.g. "-s dynamic").')
+
+    parser.add_argument('-o', '--output', default='bpgrepwc.json',
+                        help='Ficheiro JSON onde são guardados os resultados. Por omissão, bpgrepwc.json.')
+
+    parser.add_argument('-c', '--compare', type=str,
+                        help='Ficheiro JSON de uma medição anterior: as medições mais lentas que essa (além de \
+                            --tolerance) são assinaladas e o programa termina com o código 1.')
+
+    parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                        help='Fração do tempo da medição anterior tolerada na opção --compare. Por omissão, 0.1 (10%%).')
+
+    args = parser.parse_args().__dict__
+
+    if args['repeat'] < 1 or args['size'] < 1:
+        raise UserWarning('Arguments -r and --size must be greater than 0.')
+
+    if min(args['parallelization']) < 0:
+        raise UserWarning('Argument -p must not be smaller than 0.')
+
+    if not all(1 <= k <= len(args['words']) for k in args['word_counts']):
+        raise UserWarning(f'Argument -k must be between 1 and the word count ({len(args["words"])}).')
+
+    # Remover duplicados
+    args['parallelization'] = sorted(set(args['parallelization']))
+    args['word_counts'] = sorted(set(args['word_counts']))
+
+    return args
+
+def run(argv: List[str]) -> Tuple[float, int]:
+    """
+    Executa o pgrepwc (sem stdin nem stdout) e mede o tempo e a memória.
+    :param argv: Lista de argumentos do pgrepwc
+    :return: Tuplo com o tempo de execução em segundos e o maior RSS (em KiB) do pgrepwc ou de um dos seus filhos
+    """
+    inicio = time()
+    process = Popen([ sys.executable, PGREPWC ] + argv, stdin=DEVNULL, stdout=DEVNULL)
+
+    # O wait4 devolve também os recursos usados pelos filhos do pgrepwc (já terminados)
+    _, status, usage = wait4(process.pid, 0)
+    duration = time() - inicio
+
+    if WIFSIGNALED(status):
+        raise UserWarning(f'pgrepwc {" ".join(argv)} was killed by signal {WTERMSIG(status)}.')
+    code = WEXITSTATUS(status)
+    if code != 0:
+        raise UserWarning(f'pgrepwc {" ".join(argv)} terminated with code {code}.')
+
+    return duration, usage.ru_maxrss
+
+def benchmark(args: Dict[str, Union[str, int, float, List[str], List[int]]], files: List[str], total_size: int) -> List[Dict[str, Union[str, int, float, List[float]]]]:
+    """
+    Mede todas as combinações de modo, quantidade de palavras e nível de paralelização.
+    :param args: Dicionário com os argumentos (ver parse)
+    :param files: Lista de Strings com os ficheiros pesquisados
+    :param total_size: Tamanho total dos ficheiros em bytes
+    :return: Lista com os dados de cada medição: modo, quantidade de palavras, nível de paralelização, mediana e
+             lista dos tempos, débito em MiB/s, speedup em relação ao menor nível de paralelização e maior RSS.
+    """
+    extra = shell_split(args['args'])
+
+    runs = []
+    for mode in args['modes']:
+        for k in args['word_counts']:
+            words = args['words'][:k]
+            base = None # Tempo do menor nível de paralelização, para o speedup
+            for p in args['parallelization']:
+                # O pgrepwc não aceita mais processos que ficheiros
+                if p > len(files):
+                    print(f'{Fore.LIGHTBLACK_EX}-p {p} ignorado: apenas {len(files)} ficheiro(s).{Style.RESET_ALL}')
+                    continue
+
+                times, rss = [], 0
+                for _ in range(args['repeat']):
+                    duration, max_rss = run(MODES[mode] + [ '-p', str(p) ] + extra + words + [ '-f' ] + files)
+                    times.append(duration)
+                    rss = max(rss, max_rss)
+
+                seconds = median(times)
+                base = base or seconds
+                runs.append({
+                    'mode': mode,
+                    'words': len(words),
+                    'p': p,
+                    'seconds': seconds,
+                    'times': times,
+                    'mib_s': total_size / 1024 ** 2 / seconds,
+                    'speedup': base / seconds,
+                    'max_rss_kb': rss
+                })
+                print_run(runs[-1])
+
+    return runs
+
+def print_run(run: Dict[str, Union[str, int, float, List[float]]]) -> None:
+    """
+    Imprime uma medição para o stdout.
+    :param run: Dicionário com os dados da medição (ver benchmark)
+    """
+    print(f'{Fore.CYAN}{" ".join(MODES[run["mode"]]):6}{Fore.RESET} {run["words"]} palavra(s) -p {run["p"]:<3} '
+          f'{Fore.GREEN}{run["seconds"]:8.3f}{Fore.RESET} s {run["mib_s"]:9.2f} MiB/s '
+          f'speedup {run["speedup"]:5.2f} RSS {run["max_rss_kb"]} KiB')
+
+def compare(runs: List[Dict[str, Union[str, int, float, List[float]]]], path: str, tolerance: float) -> int:
+    """
+    Compara as medições com as de um ficheiro JSON anterior.
+    :param runs: Lista das medições (ver benchmark)
+    :param path: Caminho do ficheiro JSON anterior
+    :param tolerance: Fração do tempo anterior tolerada
+    :return: Quantidade de medições mais lentas que as anteriores (além da tolerância)
+    """
+    with open(path, encoding='utf-8') as f:
+        previous = { (run['mode'], run['words'], run['p']): run for run in load(f)['runs'] }
+
+    regressions = 0
+    for run in runs:
+        old = previous.get((run['mode'], run['words'], run['p']))
+        if old is not None and run['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions += 1
+            print(f'{Fore.LIGHTRED_EX}Regressão: {" ".join(MODES[run["mode"]])} {run["words"]} palavra(s) -p {run["p"]}: '
+                  f'{old["seconds"]:.3f} s -> {run["seconds"]:.3f} s{Style.RESET_ALL}')
+
+    return regressions
+
+def main() -> None:
+    """
+    Main
+    """
+    init()
+    args = parse()
+
+    # Gerar os ficheiros (tantos quanto o maior nível de paralelização)
+    corpus = None
+    files = args['files']
+    if not files:
+        corpus = mkdtemp(prefix='bpgrepwc-')
+        n = max(max(args['parallelization']), 1)
+        print(f'{Fore.LIGHTBLACK_EX}A gerar {n} ficheiro(s) em {corpus}...{Style.RESET_ALL}')
+        files = [ join(corpus, f'f{i}.txt') for i in range(n) ]
+        for i, path in enumerate(files):
+            gerar(path, args['size'] // n, words=args['words'], seed=i)
+
+    total_size = sum(getsize(path) for path in files)
+    try:
+        runs = benchmark(args, files, total_size)
+    finally:
+        if corpus:
+            rmtree(corpus)
+
+    with open(args['output'], 'w', encoding='utf-8') as f:
+        dump({
+            'date': strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': python_version(),
+            'platform': platform(),
+            'cpu_count': cpu_count(),
+            'files': len(files),
+            'bytes': total_size,
+            'args': args['args'],
+            'runs': runs
+        }, f, indent=2)
+    print(f'{Fore.LIGHTBLACK_EX}Resultados guardados em {args["output"]}.{Style.RESET_ALL}')
+
+    if args['compare'] and compare(runs, args['compare'], args['tolerance']):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
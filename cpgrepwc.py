@@ -0,0 +1,74 @@
+from sys import stdout
+from os import getcwd
+from json import dumps
+from typing import Dict, List, Union
+from shlex import split as shell_split
+from socket import socket, AF_UNIX, SOCK_STREAM
+from argparse import ArgumentParser, REMAINDER
+
+def parse() -> Dict[str, Union[str, List[str]]]:
+    """
+    Define o parser de argumentos.
+
+    :return: Dict com valores dos argumentos escolhidos pelo utilizador.
+    """
+    parser = ArgumentParser(description='Cliente do pgrepwc em modo servidor (pgrepwc.py --daemon SOCKET). \
+                                            Envia a pesquisa ao servidor e escreve a resposta no stdout.')
+
+    parser.add_argument('socket',
+                        help='Caminho do socket Unix do servidor.')
+
+    parser.add_argument('argumentos', nargs=REMAINDER,
+                        help='Argumentos da pesquisa, os mesmos do pgrepwc.')
+
+    args = parser.parse_args().__dict__
+
+    return args
+
+def read_list(text: str) -> List[str]:
+    """
+    Lê e divide uma linha do stdin.
+    :param text: String com a mensagem a mostrar ao utilizador.
+    :return: Lista de Strings com os elementos da linha.
+    """
+    inp = input(text)
+    files = inp
+
+    # Enquanto a linha não for vazia lê mais valores
+    while inp:
+        inp = input()
+        files += f' {inp}'
+
+    # Partir os valores pelo espaço (caminhos com espaços entre aspas, como na shell)
+    try:
+        return shell_split(files)
+    except ValueError:
+        # Aspas por fechar (e.g. it's.txt): sem aspas, os caminhos são partidos apenas pelo espaço
+        return files.split()
+
+def main() -> None:
+    """
+    Main
+    """
+    args = parse()
+    argv = args['argumentos']
+
+    # O servidor não lê do stdin do cliente, por isso os ficheiros são pedidos aqui (exceto com -r)
+    if not { '-f', '--files', '-r', '--recursive', '-h', '--help' } & set(argv):
+        argv += ['-f', *read_list('Insira o(s) ficheiro(s) a pesquisar: ')]
+
+    with socket(AF_UNIX, SOCK_STREAM) as conn:
+        conn.connect(args['socket'])
+        # As cores da resposta dependem do terminal do cliente, não do servidor
+        conn.sendall(dumps({ 'argv': argv, 'cwd': getcwd(), 'color': stdout.isatty() }).encode('utf-8') + b'\n')
+
+        # Escrever a resposta à medida que chega
+        while data := conn.recv(65536):
+            stdout.buffer.write(data)
+            stdout.buffer.flush()
+
+if __name__ == '__main__':
+    try:
+        main()
+    except (UserWarning, OSError) as w:
+        print(w)
@@ -1,58 +1,181 @@
-with open('fgrande.txt', 'w') as f:
-    linhas = [ str(i) for i in range(1000000) ]
-    f.write('\nbatatas\n')
-    f.write('\n'.join(linhas))
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nmilho\n')
-    f.write('\nbatatas\n')
\ No newline at end of file
+from random import Random
+from os.path import splitext
+from typing import Dict, List, Union
+from argparse import ArgumentParser
+
+# Vogais substituídas por vogais acentuadas nas palavras com acentos (ver accented)
+ACCENTS = { 'a': 'áàãâ', 'e': 'éê', 'i': 'í', 'o': 'óõô', 'u': 'ú', 'c': 'ç' }
+
+# Letras das palavras de enchimento (ver vocabulary)
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+# Palavras de enchimento diferentes em cada ficheiro
+VOCABULARY_SIZE = 5000
+
+def parse_size(text: str) -> int:
+    """
+    Converte um tamanho com sufixo opcional (K, M ou G, em potências de 1024) em bytes.
+    :param text: String com o tamanho (e.g. 64M)
+    :return: Tamanho em bytes
+    """
+    units = { 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3 }
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def parse() -> Dict[str, Union[str, int, float, List[str]]]:
+    """
+    Define o parser de argumentos.
+
+    :return: Dict com valores dos argumentos escolhidos pelo utilizador.
+    """
+    parser = ArgumentParser(description='Gera ficheiros de texto aleatórios (mas reprodutíveis) para testar \
+                                            e medir o desempenho do pgrepwc.')
+
+    parser.add_argument('-o', '--output', default='fgrande.txt',
+                        help='Ficheiro gerado. Com vários ficheiros, é acrescentado _i antes da extensão \
+                            (e.g. fgrande_0.txt). Por omissão, fgrande.txt.')
+
+    parser.add_argument('-n', '--files', type=int, default=1,
+                        help='Quantidade de ficheiros gerados. Por omissão, 1.')
+
+    parser.add_argument('-s', '--size', type=parse_size, default=parse_size('8M'),
+                        help='Tamanho (aproximado) de cada ficheiro, em bytes, com sufixo K, M ou G opcional. \
+                            Por omissão, 8M.')
+
+    parser.add_argument('-l', '--line-length', type=int, default=10,
+                        help='Quantidade média de palavras por linha. Por omissão, 10.')
+
+    parser.add_argument('-d', '--distribution', choices=('fixed', 'uniform', 'exponential'), default='uniform',
+                        help='Distribuição da quantidade de palavras por linha: fixed (sempre a média), uniform \
+                            (entre 1 e o dobro da média) ou exponential (muitas linhas curtas e algumas muito longas). \
+                            Por omissão, uniform.')
+
+    parser.add_argument('-w', '--words', nargs='+', default=['batatas', 'milho', 'antonio'],
+                        help='Palavras encontradas pelo pgrepwc, misturadas com as palavras de enchimento. \
+                            Por omissão, batatas milho antonio.')
+
+    parser.add_argument('-m', '--density', type=float, default=0.05,
+                        help='Probabilidade de cada palavra ser uma das palavras de -w. Por omissão, 0.05.')
+
+    parser.add_argument('-u', '--unicode', type=float, default=0.1,
+                        help='Probabilidade de cada palavra ter acentos (e.g. batátas, que o pgrepwc também encontra). \
+                            Com 0, os ficheiros são ASCII. Por omissão, 0.1.')
+
+    parser.add_argument('--seed', type=int, default=19,
+                        help='Semente dos números aleatórios: a mesma semente gera os mesmos ficheiros. Por omissão, 19.')
+
+    args = parser.parse_args().__dict__
+
+    if args['files'] < 1 or args['size'] < 1 or args['line_length'] < 1:
+        raise UserWarning('Arguments -n, -s and -l must be greater than 0.')
+
+    if not 0 <= args['density'] <= 1 or not 0 <= args['unicode'] <= 1:
+        raise UserWarning('Arguments -m and -u must be between 0 and 1.')
+
+    return args
+
+def accented(word: str, rng: Random) -> str:
+    """
+    Acentua uma vogal (ou o c) de uma palavra, se tiver alguma.
+    :param word: String com a palavra
+    :param rng: Gerador de números aleatórios
+    :return: String com a palavra acentuada
+    """
+    positions = [ i for i, c in enumerate(word) if c in ACCENTS ]
+    if not positions:
+        return word
+
+    i = rng.choice(positions)
+    return word[:i] + rng.choice(ACCENTS[word[i]]) + word[i + 1:]
+
+def vocabulary(words: List[str], rng: Random) -> List[str]:
+    """
+    Cria as palavras de enchimento: palavras aleatórias de 2 a 12 letras, diferentes das palavras de words.
+    :param words: Lista de Strings com as palavras encontradas pelo pgrepwc
+    :param rng: Gerador de números aleatórios
+    :return: Lista de Strings com as palavras de enchimento
+    """
+    res = set()
+    while len(res) < VOCABULARY_SIZE:
+        word = ''.join(rng.choices(LETTERS, k=rng.randint(2, 12)))
+        if word not in words:
+            res.add(word)
+    return sorted(res)
+
+def line_length(mean: int, distribution: str, rng: Random) -> int:
+    """
+    Sorteia a quantidade de palavras de uma linha.
+    :param mean: Quantidade média de palavras por linha
+    :param distribution: Distribuição (ver parse)
+    :param rng: Gerador de números aleatórios
+    :return: Quantidade de palavras (pelo menos 1)
+    """
+    if distribution == 'fixed':
+        return mean
+    if distribution == 'uniform':
+        return rng.randint(1, 2 * mean - 1)
+    return max(1, round(rng.expovariate(1 / mean)))
+
+def gerar(path: str, size: int, line_words: int = 10, distribution: str = 'uniform', words: List[str] = None,
+          density: float = 0.05, unicode: float = 0.1, seed: int = 19) -> int:
+    """
+    Gera um ficheiro de texto aleatório.
+    :param path: Caminho do ficheiro
+    :param size: Tamanho (aproximado, acaba no fim de uma linha) do ficheiro em bytes
+    :param line_words?: Quantidade média de palavras por linha
+    :param distribution?: Distribuição da quantidade de palavras por linha (ver parse)
+    :param words?: Lista de Strings com as palavras encontradas pelo pgrepwc
+    :param density?: Probabilidade de cada palavra ser uma das palavras de words
+    :param unicode?: Probabilidade de cada palavra ter acentos
+    :param seed?: Semente dos números aleatórios
+    :return: Tamanho do ficheiro em bytes
+    """
+    rng = Random(seed)
+    words = words or ['batatas', 'milho', 'antonio']
+    filler = vocabulary(words, rng)
+
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        while written < size:
+            line = []
+            for _ in range(line_length(line_words, distribution, rng)):
+                word = rng.choice(words) if rng.random() < density else rng.choice(filler)
+                line.append(accented(word, rng) if rng.random() < unicode else word)
+
+            line = ' '.join(line) + '\n'
+            f.write(line)
+            written += len(line.encode('utf-8'))
+
+    return written
+
+def file_name(path: str, i: int, n: int) -> str:
+    """
+    Nome do ficheiro i de n (com _i antes da extensão, se houver mais que um ficheiro).
+    :param path: Caminho base (ver parse)
+    :param i: Índice do ficheiro
+    :param n: Quantidade de ficheiros
+    :return: Caminho do ficheiro
+    """
+    if n == 1:
+        return path
+
+    base, ext = splitext(path)
+    return f'{base}_{i}{ext}'
+
+def main() -> None:
+    """
+    Main
+    """
+    args = parse()
+
+    for i in range(args['files']):
+        path = file_name(args['output'], i, args['files'])
+        # Cada ficheiro tem uma semente diferente, para não serem iguais
+        size = gerar(path, args['size'], args['line_length'], args['distribution'], args['words'],
+                     args['density'], args['unicode'], args['seed'] + i)
+        print(f'{path}: {size} bytes')
+
+if __name__ == '__main__':
+    main()
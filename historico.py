@@ -0,0 +1,292 @@
+from os import fstat
+from mmap import mmap, ACCESS_READ
+from struct import Struct
+from typing import Dict, Generator, List, Union
+
+# Formato binário do histórico de execução do pgrepwc (opção -o), lido pelo hpgrepwc.
+#
+# O ficheiro começa com um cabeçalho (HEADER: assinatura e versão) e cada execução é acrescentada no fim, num
+# segmento que começa com um registo RUN, com o tamanho do segmento (para saltar execuções sem as ler) e a
+# quantidade de elementos de cada tabela, seguido das tabelas de registos de tamanho fixo, por esta ordem:
+#   palavras .............. n_words × WORD (índice na tabela de strings)
+#   binários ignorados .... n_skipped × WORD
+#   ficheiros ............. n_files × FILE_STAT (caminho, tamanho e mtime, para validar a retoma)
+#   processos ............. n_processes × PROCESS (pid, tempos, primeira parcela, quantidade de parcelas e flags)
+#   parcelas .............. n_records × RECORD (caminho, intervalo, duração, linhas e tempos de cada fase)
+#   ocorrências ........... n_records × n_words × COUNT
+#   strings ............... (n_strings + 1) × OFFSET, seguido dos bytes UTF-8 das strings (caminhos e palavras)
+# Todos os inteiros são little-endian; os tempos estão em µs e são -1 quando não foram medidos.
+# Um segmento incompleto no fim do ficheiro (e.g. execução interrompida durante a escrita) é ignorado, e descartado
+# quando a execução seguinte é acrescentada.
+#
+# Um histórico de outra versão não é lido (ver read_header).
+
+MAGIC = b'PGRH'
+VERSION = 1
+
+HEADER = Struct('<4sHH') # assinatura, versão, reservado
+RUN = Struct('<4sQqqiiB3xIIIIIII4q') # assinatura, tamanho, início, duração, filhos, intervalo, flags, quantidades, tempos
+PROCESS = Struct('<qqqIIB') # pid, tempo à espera de parcelas, tempo a comunicar, primeira parcela, quantidade de parcelas, flags
+RECORD = Struct('<IqqBqq5q') # caminho, início, fim, completa, duração, linhas, tempos das fases
+FILE_STAT = Struct('<Iqq') # caminho, tamanho, mtime em ns
+WORD = Struct('<I')
+COUNT = Struct('<q')
+OFFSET = Struct('<I')
+
+RUN_MAGIC = b'PGRR'
+
+# Bits do campo flags do registo RUN
+FLAG_ALL, FLAG_COUNT, FLAG_RESUMED = 1, 2, 4
+
+# Bits do campo flags do registo PROCESS: processo da execução retomada, copiado para esta (ver --resume)
+PROCESS_PREVIOUS = 1
+
+# Fases guardadas (pela ordem dos registos), com os mesmos nomes do pgrepwc
+RUN_PHASES = ('indexing', 'spawn', 'search', 'merge')
+PROCESS_PHASES = ('wait', 'ipc')
+PHASES = ('read', 'decode', 'fold', 'match', 'commit')
+
+def is_history(path: str) -> bool:
+    """
+    Verifica se um ficheiro é um histórico (de qualquer versão), pela assinatura.
+    :param path: Caminho do ficheiro
+    :return: True se o ficheiro começar com a assinatura do histórico
+    """
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+def check(path: str) -> None:
+    """
+    Verifica se um ficheiro pode receber o histórico de uma execução: não existe, está vazio ou é um histórico
+    de uma versão conhecida. Evita acrescentar execuções a um ficheiro de outro formato (e.g. um histórico antigo, em pickle).
+    :param path: Caminho do ficheiro
+    """
+    try:
+        with open(path, 'rb') as file:
+            head = file.read(HEADER.size)
+    except FileNotFoundError:
+        return
+
+    if head:
+        read_header(head, path)
+
+def read_header(data: Union[bytes, mmap], path: str) -> None:
+    """
+    Valida o cabeçalho do ficheiro.
+    :param data: Conteúdo (ou início) do ficheiro
+    :param path: Caminho do ficheiro (para as mensagens de erro)
+    """
+    if len(data) < HEADER.size or HEADER.unpack_from(data)[0] != MAGIC:
+        raise UserWarning(f'{path} is not a pgrepwc history (older histories, in pickle format, are not supported).')
+
+    version = HEADER.unpack_from(data)[1]
+    if version != VERSION:
+        raise UserWarning(f'{path} was written by another version of pgrepwc (history version {version}, expected {VERSION}).')
+
+def timings(values: List[int], phases: tuple) -> Dict[str, int]:
+    """
+    Converte os tempos de um registo num dicionário, sem os que não foram medidos.
+    :param values: Tempos em µs (-1 se não foram medidos)
+    :param phases: Nomes das fases, pela ordem dos tempos
+    :return: Dicionário com o tempo de cada fase medida
+    """
+    return { phase: us for phase, us in zip(phases, values) if us >= 0 }
+
+def encode_run(run: Dict) -> bytes:
+    """
+    Codifica uma execução num segmento.
+    :param run: Dicionário com os dados da execução, como escrito pelo pgrepwc (ver output)
+    :return: Bytes do segmento
+    """
+    strings = {}
+    def string(s: str) -> int:
+        return strings.setdefault(s, len(strings))
+
+    words = [ WORD.pack(string(word)) for word in run['words'] ]
+    skipped = [ WORD.pack(string(path)) for path in run['binary_skipped'] ]
+    files = [ FILE_STAT.pack(string(path), size, mtime) for path, (size, mtime) in run['files'].items() ]
+
+    processes, records, counts = [], [], []
+    for process in run['processes']:
+        process_timings = process.get('timings', {})
+        processes.append(PROCESS.pack(process['pid'], *(process_timings.get(phase, -1) for phase in PROCESS_PHASES), len(records), len(process['files']),
+                                      PROCESS_PREVIOUS if process.get('previous') else 0))
+        for f in process['files']:
+            f_timings = f.get('timings', {})
+            records.append(RECORD.pack(string(f['path']), f['start'], f['end'], f['complete'], f['duration'], f['lines'],
+                                       *(f_timings.get(phase, -1) for phase in PHASES)))
+            counts += [ COUNT.pack(qtty) for qtty in f['occurrences'] ]
+
+    data = [ s.encode('utf-8', 'surrogateescape') for s in strings ]
+    offsets = [ 0 ]
+    for s in data:
+        offsets.append(offsets[-1] + len(s))
+
+    body = b''.join(words + skipped + files + processes + records + counts + [ OFFSET.pack(o) for o in offsets ] + data)
+    flags = (FLAG_ALL if run['all'] else 0) | (FLAG_COUNT if run['count'] else 0) | (FLAG_RESUMED if run.get('resumed') else 0)
+    head = RUN.pack(RUN_MAGIC, RUN.size + len(body), run['start'], run['duration'], run['children'], run['interval'] or 0, flags,
+                    len(words), len(skipped), len(files), len(processes), len(records), len(strings), offsets[-1],
+                    *(run.get('timings', {}).get(phase, -1) for phase in RUN_PHASES))
+    return head + body
+
+def append_run(path: str, run: Dict) -> None:
+    """
+    Acrescenta uma execução ao histórico (criado se não existir), numa só escrita.
+    :param path: Caminho do ficheiro
+    :param run: Dicionário com os dados da execução (ver encode_run)
+    """
+    check(path)
+    segment = encode_run(run)
+    end = runs_end(path)
+    with open(path, 'ab') as file:
+        # Um segmento incompleto no fim ficaria antes deste, e o histórico deixaria de poder ser lido (ver segments)
+        if file.tell() > end:
+            file.truncate(end)
+        if end == 0:
+            segment = HEADER.pack(MAGIC, VERSION, 0) + segment
+        file.write(segment)
+
+def runs_end(path: str) -> int:
+    """
+    Posição do fim do último segmento completo do histórico (ver segments).
+    :param path: Caminho do ficheiro (com o cabeçalho já validado, ver check)
+    :return: Tamanho do histórico sem o segmento incompleto no fim (0 se o ficheiro não existir ou estiver vazio)
+    """
+    try:
+        with open(path, 'rb') as file:
+            if fstat(file.fileno()).st_size == 0:
+                return 0
+
+            with mmap(file.fileno(), 0, access=ACCESS_READ) as m:
+                end = HEADER.size
+                for offset in segments(m, path):
+                    end = offset + RUN.unpack_from(m, offset)[1]
+                return end
+    except FileNotFoundError:
+        return 0
+
+def segments(m: mmap, path: str) -> Generator[int, None, None]:
+    """
+    Percorre os segmentos (execuções) do histórico, sem os ler.
+    :param m: Ficheiro mapeado em memória (com o cabeçalho já validado, ver read_header)
+    :param path: Caminho do ficheiro (para as mensagens de erro)
+    :return: Gerador das posições de cada segmento completo
+    """
+    offset = HEADER.size
+    while offset + RUN.size <= len(m):
+        magic, size = RUN.unpack_from(m, offset)[:2]
+        if magic != RUN_MAGIC:
+            raise UserWarning(f'{path} is corrupted at byte {offset}.')
+        # Segmento incompleto (escrita interrompida)
+        if offset + size > len(m):
+            return
+
+        yield offset
+        offset += size
+
+def run_start(m: mmap, offset: int) -> int:
+    """
+    Lê o início de uma execução, sem ler o resto do segmento.
+    :param m: Ficheiro mapeado em memória
+    :param offset: Posição do segmento (ver segments)
+    :return: UNIX timestamp (em µs) do início da execução
+    """
+    return RUN.unpack_from(m, offset)[2]
+
+def decode_run(m: mmap, offset: int) -> Dict:
+    """
+    Lê a execução de um segmento.
+    :param m: Ficheiro mapeado em memória
+    :param offset: Posição do segmento (ver segments)
+    :return: Dicionário com os dados da execução, com os mesmos campos escritos pelo pgrepwc (ver encode_run)
+    """
+    (_, _, start, duration, children, interval, flags,
+     n_words, n_skipped, n_files, n_processes, n_records, n_strings, strings_size, *run_timings) = RUN.unpack_from(m, offset)
+
+    pos = offset + RUN.size
+    def table(struct: Struct, n: int) -> List[tuple]:
+        nonlocal pos
+        rows = [ struct.unpack_from(m, pos + i * struct.size) for i in range(n) ]
+        pos += n * struct.size
+        return rows
+
+    words = table(WORD, n_words)
+    skipped = table(WORD, n_skipped)
+    files = table(FILE_STAT, n_files)
+    processes = table(PROCESS, n_processes)
+    records = table(RECORD, n_records)
+    counts = [ qtty for qtty, in table(COUNT, n_records * n_words) ]
+    offsets = [ o for o, in table(OFFSET, n_strings + 1) ]
+    strings = [ str(m[pos + offsets[i]:pos + offsets[i + 1]], 'utf-8', 'surrogateescape') for i in range(n_strings) ]
+
+    run = {
+        'start': start,
+        'duration': duration,
+        'children': children,
+        'all': bool(flags & FLAG_ALL),
+        'count': bool(flags & FLAG_COUNT),
+        'resumed': bool(flags & FLAG_RESUMED),
+        'interval': interval,
+        'words': [ strings[i] for i, in words ],
+        'files': { strings[i]: [size, mtime] for i, size, mtime in files },
+        'binary_skipped': [ strings[i] for i, in skipped ],
+        'timings': timings(run_timings, RUN_PHASES),
+        'processes': []
+    }
+
+    for pid, wait, ipc, first, n, process_flags in processes:
+        process = { 'pid': pid, 'timings': timings([wait, ipc], PROCESS_PHASES), 'previous': bool(process_flags & PROCESS_PREVIOUS), 'files': [] }
+        for r in range(first, first + n):
+            path, f_start, end, complete, f_duration, lines, *f_timings = records[r]
+            process['files'].append({
+                'path': strings[path],
+                'start': f_start,
+                'end': end,
+                'complete': bool(complete),
+                'duration': f_duration,
+                'timings': timings(f_timings, PHASES),
+                'lines': lines,
+                'occurrences': counts[r * n_words:(r + 1) * n_words]
+            })
+        run['processes'].append(process)
+
+    return run
+
+def read_runs(path: str, since: int = None, until: int = None) -> Generator[Dict, None, None]:
+    """
+    Lê as execuções de um histórico, uma de cada vez (o ficheiro é mapeado em memória e não é carregado).
+    :param path: Caminho do ficheiro
+    :param since?: UNIX timestamp (em µs): as execuções que começaram antes são saltadas sem serem lidas
+    :param until?: UNIX timestamp (em µs): as execuções que começaram depois são saltadas sem serem lidas
+    :return: Gerador das execuções, pela ordem em que foram acrescentadas (ver decode_run)
+    """
+    with open(path, 'rb') as file:
+        if fstat(file.fileno()).st_size == 0:
+            return
+
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as m:
+            read_header(m, path)
+            for offset in segments(m, path):
+                start = run_start(m, offset)
+                if (since is None or start >= since) and (until is None or start <= until):
+                    yield decode_run(m, offset)
+
+def last_run(path: str) -> Union[Dict, None]:
+    """
+    Lê a última execução de um histórico (as anteriores são saltadas sem serem lidas).
+    :param path: Caminho do ficheiro
+    :return: Dicionário com os dados da execução (ver decode_run), ou None se o histórico não tiver execuções
+    """
+    with open(path, 'rb') as file:
+        if fstat(file.fileno()).st_size == 0:
+            return None
+
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as m:
+            read_header(m, path)
+            last = None
+            for last in segments(m, path):
+                pass
+            return decode_run(m, last) if last is not None else None
@@ -1,12 +1,53 @@
-from pickle import load
-from typing import Dict
+import sys
+from os import walk
+from os.path import isdir, join
+from heapq import heappush, heappushpop
+from fnmatch import fnmatch
+from json import dumps
+from typing import Dict, Generator, Iterable, List, Tuple, Union
 from datetime import datetime, timedelta
 from argparse import ArgumentParser
 
 from colorama import Fore, init
 init() # Inicialização colorama
 
-def parse() -> Dict[str, str]:
+from historico import read_runs, is_history
+
+# Nomes das fases da execução (no processo pai) guardadas no histórico
+RUN_PHASES = { 'indexing': 'indexação', 'spawn': 'criação dos processos', 'search': 'pesquisa', 'merge': 'junção dos resultados' }
+
+# Nomes das fases de cada parcela guardadas no histórico
+PHASES = { 'read': 'leitura', 'decode': 'descodificação', 'fold': 'remoção de acentos', 'match': 'pesquisa', 'commit': 'registo' }
+
+# Colunas de cada agregação (opção -g): chave, título e largura (as larguras negativas alinham à esquerda)
+COLUMNS = {
+    'files': [ ('path', 'ficheiro', -40), ('parcels', 'parcelas', 8), ('partial', 'incompletas', 11), ('bytes', 'bytes', 14),
+               ('lines', 'linhas', 12), ('duration', 'tempo', 16), ('mib_s', 'MiB/s', 9) ],
+    'slowest': [ ('path', 'ficheiro', -40), ('start', 'início', 12), ('end', 'fim', 12), ('duration', 'tempo', 16),
+                 ('mib_s', 'MiB/s', 9), ('pid', 'processo', 8), ('run', 'execução', 26) ],
+    'workers': [ ('run', 'execução', -26), ('pid', 'processo', 8), ('parcels', 'parcelas', 8), ('partial', 'incompletas', 11), ('bytes', 'bytes', 14),
+                 ('duration', 'tempo', 16), ('wait', 'espera', 16), ('ipc', 'comunicação', 16), ('mib_s', 'MiB/s', 9) ],
+    'trends': [ ('run', 'execução', -26), ('children', 'filhos', 6), ('duration', 'duração', 16), ('parcels', 'parcelas', 8),
+                ('partial', 'incompletas', 11), ('bytes', 'bytes', 14), ('lines', 'linhas', 12), ('mib_s', 'MiB/s', 9), ('read', 'leitura %', 9),
+                ('match', 'pesquisa %', 10) ]
+}
+
+# Colunas com tempos (em µs) e com datas (UNIX timestamp em µs)
+TIME_COLUMNS = ('duration', 'wait', 'ipc')
+DATE_COLUMNS = ('run',)
+
+def parse_date(text: str) -> int:
+    """
+    Converte uma data (AAAA-MM-DD, opcionalmente com HH:MM[:SS]) numa UNIX timestamp em µs.
+    :param text: String com a data
+    :return: UNIX timestamp em µs
+    """
+    try:
+        return int(datetime.fromisoformat(text).timestamp() * 1000000)
+    except ValueError:
+        raise UserWarning(f'Invalid date {text} (expected YYYY-MM-DD[ HH:MM[:SS]]).')
+
+def parse() -> Dict[str, Union[str, int, float, bool, List[str]]]:
     """
     Define o parser de argumentos.
 
@@ -14,11 +55,44 @@ def parse() -> Dict[str, str]:
     """
     parser = ArgumentParser(description='Lê o histórico de execução do programa pgrepwc')
 
-    parser.add_argument('file',
-                        help='Caminho do ficheiro binário.')
+    parser.add_argument('files', nargs='+',
+                        help='Caminhos dos ficheiros binários, ou diretorias com ficheiros binários (os restantes \
+                            ficheiros das diretorias são ignorados).')
+
+    parser.add_argument('--path', type=str,
+                        help='Apenas as parcelas dos ficheiros cujo caminho corresponde ao padrão glob (e.g. "*.log").')
+
+    parser.add_argument('--since', type=str,
+                        help='Apenas as execuções que começaram a partir desta data (AAAA-MM-DD[ HH:MM[:SS]]).')
+
+    parser.add_argument('--until', type=str,
+                        help='Apenas as execuções que começaram até esta data (AAAA-MM-DD[ HH:MM[:SS]]).')
+
+    parser.add_argument('--min-duration', type=float, default=0,
+                        help='Apenas as parcelas que demoraram pelo menos estes segundos.')
+
+    parser.add_argument('-g', '--aggregate', choices=tuple(COLUMNS),
+                        help='Em vez de cada execução, imprime uma tabela: files (bytes, linhas e tempo de cada ficheiro), \
+                            slowest (as parcelas mais lentas, ver --limit), workers (débito de cada processo de cada \
+                            execução) ou trends (uma linha por execução, por ordem de início).')
+
+    parser.add_argument('--limit', type=int, default=10,
+                        help='Quantidade de parcelas da agregação slowest. Por omissão, 10.')
+
+    parser.add_argument('--json', action='store_true',
+                        help='Escreve em JSON, um objeto por linha (uma execução, ou uma linha da tabela com -g).')
 
     args = parser.parse_args().__dict__
 
+    if args['limit'] <= 0:
+        raise UserWarning('Argument --limit must be greater than 0.')
+
+    if args['min_duration'] < 0:
+        raise UserWarning('Argument --min-duration must not be negative.')
+
+    args['since'] = parse_date(args['since']) if args['since'] else None
+    args['until'] = parse_date(args['until']) if args['until'] else None
+
     return args
 
 def unix_to_datetime(unix: int) -> str:
@@ -37,46 +111,290 @@ def us_to_time(us: int) -> str:
     """
     return str(timedelta(microseconds=us)).replace('.', ':')
 
-def main() -> None:
+def dots(text: str, width: int = 34) -> str:
     """
-    Main
+    Pontos que alinham o valor à frente de um texto
+    :param text: texto antes dos pontos
+    :param width?: largura do texto e dos pontos
+    :return: os pontos
     """
-    args = parse()
+    return '.' * max(width - len(text), 2)
+
+def mib_s(size: int, us: int) -> float:
+    """
+    Débito em MiB/s
+    :param size: bytes lidos
+    :param us: tempo em µs
+    :return: MiB/s (0 se o tempo for 0)
+    """
+    return round(size / 1024 ** 2 / (us / 1000000), 2) if us else 0.0
 
-    with open(args['file'], 'rb') as file:
-        dados = load(file)
+def searched(f: Dict) -> int:
+    """
+    Bytes pesquisados de uma parcela. O histórico não guarda até onde foi pesquisada uma parcela incompleta
+    (terminada a meio pela opção -m, por um SIGINT ou por um erro de leitura), que por isso conta como 0 bytes
+    :param f: parcela
+    :return: bytes do intervalo da parcela, ou 0 se estiver incompleta
+    """
+    return f['end'] - f['start'] if f['complete'] else 0
 
-        inicio = unix_to_datetime(dados['start'])
-        duration = us_to_time(dados['duration'])
-        opt_all = 'Sim' if dados['all'] else 'Não'
+def histories(paths: List[str]) -> Generator[str, None, None]:
+    """
+    Caminhos dos históricos dados, com os das diretorias (percorridas recursivamente, por ordem alfabética).
+    :param paths: caminhos de ficheiros ou diretorias
+    :return: gerador dos caminhos dos históricos
+    """
+    for path in paths:
+        if not isdir(path):
+            yield path
+            continue
 
-        occurrences = 'ocorrências' if dados['count'] else 'linhas'
+        for root, dirs, files in walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                if is_history(join(root, name)):
+                    yield join(root, name)
 
-        res = [f'Início da execução da pesquisa: {Fore.LIGHTBLACK_EX}.. {Fore.LIGHTGREEN_EX}{inicio}',
-               f'{Fore.RESET}Duração da execução: {Fore.LIGHTBLACK_EX}............. {Fore.LIGHTGREEN_EX}{duration}',
-               f'{Fore.RESET}Número de processos filhos: {Fore.LIGHTBLACK_EX}...... {Fore.LIGHTGREEN_EX}{dados["children"]}',
-               f'{Fore.RESET}Opção -a ativada: {Fore.LIGHTBLACK_EX}................ {Fore.LIGHTGREEN_EX}{opt_all}']
+def runs(args: Dict[str, Union[str, int, float, bool, List[str]]]) -> Generator[Tuple[str, Dict], None, None]:
+    """
+    Lê as execuções de todos os históricos, uma de cada vez, só com as parcelas que passam os filtros
+    (as execuções fora do intervalo de datas não chegam a ser lidas).
+    :param args: argumentos (ver parse)
+    :return: gerador de tuplos com o caminho do histórico e a execução
+    """
+    min_duration = int(args['min_duration'] * 1000000)
+    for path in histories(args['files']):
+        for dados in read_runs(path, args['since'], args['until']):
+            for p in dados['processes']:
+                p['files'] = [ f for f in p['files'] if f['duration'] >= min_duration and (not args['path'] or fnmatch(f['path'], args['path'])) ]
+            yield path, dados
+
+def own_processes(dados: Dict) -> List[Dict]:
+    """
+    Processos da própria execução (sem os copiados da execução retomada, para não serem contados duas vezes).
+    :param dados: execução
+    :return: lista dos processos
+    """
+    return [ p for p in dados['processes'] if not p['previous'] ]
+
+def aggregate_files(items: Iterable) -> List[Dict]:
+    """
+    Agregação files: parcelas, bytes, linhas e tempo de cada ficheiro, somados em todas as execuções.
+    Os bytes e o débito são apenas das parcelas completas (ver searched); as incompletas são contadas à parte.
+    :param items: execuções (ver runs)
+    :return: linhas da tabela, por ordem decrescente de bytes
+    """
+    totals = {}
+    complete_duration = {}
+    for _, dados in items:
+        for p in own_processes(dados):
+            for f in p['files']:
+                row = totals.setdefault(f['path'], { 'path': f['path'], 'parcels': 0, 'partial': 0, 'bytes': 0, 'lines': 0, 'duration': 0 })
+                row['parcels'] += 1
+                row['partial'] += not f['complete']
+                row['bytes'] += searched(f)
+                row['lines'] += f['lines']
+                row['duration'] += f['duration']
+                if f['complete']:
+                    complete_duration[f['path']] = complete_duration.get(f['path'], 0) + f['duration']
 
-        if dados['interval']:
-            res.append(f'{Fore.RESET}Emissão de alarmes no intervalo de {Fore.LIGHTGREEN_EX}{dados["interval"]} segundos')
+    for row in totals.values():
+        row['mib_s'] = mib_s(row['bytes'], complete_duration.get(row['path'], 0))
+    return sorted(totals.values(), key=lambda row: row['bytes'], reverse=True)
 
-        for p in dados['processes']:
-            res.append(f'{Fore.MAGENTA}Processo: {p["pid"]}')
+def aggregate_slowest(items: Iterable, limit: int) -> List[Dict]:
+    """
+    Agregação slowest: as parcelas mais lentas de todas as execuções (apenas estas ficam em memória).
+    O débito de uma parcela incompleta é 0 (ver searched).
+    :param items: execuções (ver runs)
+    :param limit: quantidade de parcelas
+    :return: linhas da tabela, da mais lenta para a mais rápida
+    """
+    heap = []
+    n = 0 # Desempate, para não comparar os dicionários
+    for _, dados in items:
+        for p in own_processes(dados):
             for f in p['files']:
-                res.append(f'\t{Fore.LIGHTMAGENTA_EX}ficheiro: {f["path"]}')
+                row = (f['duration'], n, { 'path': f['path'], 'start': f['start'], 'end': f['end'], 'duration': f['duration'],
+                                           'mib_s': mib_s(searched(f), f['duration']), 'pid': p['pid'], 'run': dados['start'] })
+                n += 1
+                if len(heap) < limit:
+                    heappush(heap, row)
+                elif row[0] > heap[0][0]:
+                    heappushpop(heap, row)
+
+    return [ row for _, _, row in sorted(heap, reverse=True) ]
+
+def aggregate_workers(items: Iterable) -> Generator[Dict, None, None]:
+    """
+    Agregação workers: parcelas, bytes, tempo de pesquisa, de espera e de comunicação e débito de cada processo.
+    Os bytes e o débito são apenas das parcelas completas (ver searched); as incompletas são contadas à parte.
+    :param items: execuções (ver runs)
+    :return: gerador das linhas da tabela, à medida que as execuções são lidas
+    """
+    for _, dados in items:
+        for p in own_processes(dados):
+            size = sum(searched(f) for f in p['files'])
+            duration = sum(f['duration'] for f in p['files'])
+            complete_duration = sum(f['duration'] for f in p['files'] if f['complete'])
+            yield { 'run': dados['start'], 'pid': p['pid'], 'parcels': len(p['files']), 'partial': sum(not f['complete'] for f in p['files']),
+                    'bytes': size, 'duration': duration, 'wait': p['timings'].get('wait', 0), 'ipc': p['timings'].get('ipc', 0),
+                    'mib_s': mib_s(size, complete_duration) }
+
+def aggregate_trends(items: Iterable) -> List[Dict]:
+    """
+    Agregação trends: uma linha por execução, com a duração, os bytes, as linhas, o débito e a percentagem
+    do tempo das parcelas gasto na leitura e na pesquisa. Os bytes são apenas das parcelas completas (ver searched).
+    :param items: execuções (ver runs)
+    :return: linhas da tabela, por ordem de início das execuções
+    """
+    rows = []
+    for path, dados in items:
+        files = [ f for p in own_processes(dados) for f in p['files'] ]
+        size = sum(searched(f) for f in files)
+        phases = { phase: sum(f['timings'].get(phase, 0) for f in files) for phase in PHASES }
+        total = sum(phases.values()) or 1
+        rows.append({ 'run': dados['start'], 'history': path, 'children': dados['children'], 'duration': dados['duration'],
+                      'parcels': len(files), 'partial': sum(not f['complete'] for f in files), 'bytes': size, 'lines': sum(f['lines'] for f in files),
+                      'mib_s': mib_s(size, dados['duration']), 'read': round(100 * phases['read'] / total, 1),
+                      'match': round(100 * phases['match'] / total, 1) })
+
+    return sorted(rows, key=lambda row: row['run'])
+
+def print_table(rows: Iterable, columns: List[Tuple[str, str, int]]) -> None:
+    """
+    Imprime uma tabela para o stdout, linha a linha
+    :param rows: linhas da tabela (dicionários)
+    :param columns: colunas (ver COLUMNS)
+    """
+    def cell(value: str, width: int) -> str:
+        return f'{value:<{-width}}' if width < 0 else f'{value:>{width}}'
+
+    print(Fore.MAGENTA + ' '.join(cell(title, width) for _, title, width in columns) + Fore.RESET)
+    for row in rows:
+        values = []
+        for key, _, width in columns:
+            value = row[key]
+            if key in TIME_COLUMNS:
+                value = us_to_time(value)
+            elif key in DATE_COLUMNS:
+                value = unix_to_datetime(value)
+            values.append(cell(str(value), width))
+        print(' '.join(values))
+
+def print_phases(totals: Dict[str, int]) -> List[str]:
+    """
+    Resumo do tempo total de cada fase de todas as parcelas, em percentagem do tempo de todas as fases,
+    para distinguir uma execução limitada pela leitura (I/O) de uma limitada pelo processamento (CPU)
+    :param totals: tempo total (em µs) de cada fase
+    :return: linhas do resumo
+    """
+    res = [f'{Fore.MAGENTA}Tempo por fase (todas as parcelas):']
+    total = sum(totals.values()) or 1
+    for phase, name in PHASES.items():
+        us = totals.get(phase, 0)
+        res.append(f'\t{Fore.RESET}{name}: {Fore.LIGHTBLACK_EX}{dots(name, 24)} {Fore.LIGHTGREEN_EX}{us_to_time(us)} ({100 * us / total:.1f}%)')
+    return res
+
+def print_run(n: int, path: str, dados: Dict) -> List[str]:
+    """
+    Todos os dados de uma execução
+    :param n: número da execução (pela ordem de leitura)
+    :param path: caminho do histórico
+    :param dados: execução
+    :return: linhas a imprimir
+    """
+    inicio = unix_to_datetime(dados['start'])
+    duration = us_to_time(dados['duration'])
+    opt_all = 'Sim' if dados['all'] else 'Não'
+
+    occurrences = 'ocorrências' if dados['count'] else 'linhas'
+
+    res = [f'{Fore.CYAN}Execução {n} ({path}){" (retomada)" if dados["resumed"] else ""}',
+           f'{Fore.RESET}Início da execução da pesquisa: {Fore.LIGHTBLACK_EX}.. {Fore.LIGHTGREEN_EX}{inicio}',
+           f'{Fore.RESET}Duração da execução: {Fore.LIGHTBLACK_EX}............. {Fore.LIGHTGREEN_EX}{duration}',
+           f'{Fore.RESET}Número de processos filhos: {Fore.LIGHTBLACK_EX}...... {Fore.LIGHTGREEN_EX}{dados["children"]}',
+           f'{Fore.RESET}Opção -a ativada: {Fore.LIGHTBLACK_EX}................ {Fore.LIGHTGREEN_EX}{opt_all}']
+
+    if dados['binary_skipped']:
+        res.append(f'{Fore.RESET}Ficheiros binários ignorados: {Fore.LIGHTBLACK_EX}... {Fore.LIGHTGREEN_EX}{len(dados["binary_skipped"])}')
+
+    if dados['interval']:
+        res.append(f'{Fore.RESET}Emissão de alarmes no intervalo de {Fore.LIGHTGREEN_EX}{dados["interval"]} segundos')
+
+    for phase, us in dados['timings'].items():
+        text = f'Tempo de {RUN_PHASES.get(phase, phase)}: '
+        res.append(f'{Fore.RESET}{text}{Fore.LIGHTBLACK_EX}{dots(text)} {Fore.LIGHTGREEN_EX}{us_to_time(us)}')
+
+    totals = {}
+    for p in dados['processes']:
+        res.append(f'{Fore.MAGENTA}Processo: {p["pid"]}{" (da execução retomada)" if p["previous"] else ""}')
+
+        if p['timings']:
+            res.append(f'\t{Fore.RESET}tempo à espera de parcelas: {Fore.LIGHTBLACK_EX}....... {Fore.LIGHTGREEN_EX}{us_to_time(p["timings"]["wait"])}')
+            res.append(f'\t{Fore.RESET}tempo a comunicar com o pai: {Fore.LIGHTBLACK_EX}...... {Fore.LIGHTGREEN_EX}{us_to_time(p["timings"]["ipc"])}')
+
+        for f in p['files']:
+            res.append(f'\t{Fore.LIGHTMAGENTA_EX}ficheiro: {f["path"]}')
+
+            duration = us_to_time(f["duration"])
+            res.append(f'\t\t{Fore.RESET}tempo de pesquisa: {Fore.LIGHTBLACK_EX}................ {Fore.LIGHTGREEN_EX}{duration}')
+            res.append(f'\t\t{Fore.RESET}dimensão do ficheiro: {Fore.LIGHTBLACK_EX}............. {Fore.LIGHTGREEN_EX}{f["lines"]}')
+            res.append(f'\t\t{Fore.RESET}intervalo em bytes: {Fore.LIGHTBLACK_EX}............... {Fore.LIGHTGREEN_EX}{f["start"]}-{f["end"]}')
 
-                duration = us_to_time(f["duration"])
-                res.append(f'\t\t{Fore.RESET}tempo de pesquisa: {Fore.LIGHTBLACK_EX}................ {Fore.LIGHTGREEN_EX}{duration}')
-                res.append(f'\t\t{Fore.RESET}dimensão do ficheiro: {Fore.LIGHTBLACK_EX}............. {Fore.LIGHTGREEN_EX}{f["lines"]}')
+            if f['timings']:
+                phases = ', '.join(f'{PHASES[phase]} {us_to_time(us)}' for phase, us in f['timings'].items())
+                res.append(f'\t\t{Fore.RESET}tempo por fase: {Fore.LIGHTBLACK_EX}................... {Fore.LIGHTGREEN_EX}{phases}')
+                for phase, us in f['timings'].items():
+                    totals[phase] = totals.get(phase, 0) + us
+
+            for i, oc in enumerate(f['occurrences']):
+                res.append(f'\t\t{Fore.RESET}número de {occurrences} da palavra_{i+1}: {Fore.LIGHTGREEN_EX}{oc}')
+
+    if totals:
+        res += print_phases(totals)
+
+    return res
+
+def main() -> None:
+    """
+    Main
+    """
+    args = parse()
+    items = runs(args)
 
-                for i, oc in enumerate(f['occurrences']):
-                    res.append(f'\t\t{Fore.RESET}número de {occurrences} da palavra_{i+1}: {Fore.LIGHTGREEN_EX}{oc}')
+    if not args['aggregate']:
+        # As execuções são lidas e impressas uma de cada vez
+        for n, (path, dados) in enumerate(items, 1):
+            if args['json']:
+                print(dumps(dict(dados, history=path), ensure_ascii=False))
+            else:
+                print('\n'.join(print_run(n, path, dados)))
+                print(Fore.RESET)
+        return
 
+    if args['aggregate'] == 'files':
+        rows = aggregate_files(items)
+    elif args['aggregate'] == 'slowest':
+        rows = aggregate_slowest(items, args['limit'])
+    elif args['aggregate'] == 'workers':
+        rows = aggregate_workers(items)
+    else:
+        rows = aggregate_trends(items)
 
-        print('\n'.join(res))
+    if args['json']:
+        for row in rows:
+            print(dumps(row, ensure_ascii=False))
+    else:
+        print_table(rows, COLUMNS[args['aggregate']])
 
 if __name__ == '__main__':
     try:
         main()
     except UserWarning as w:
         print(w)
+    except BrokenPipeError:
+        # e.g. hpgrepwc ... | head
+        sys.stderr.close()
+    except OSError as err:
+        print(err)
@@ -1,18 +1,56 @@
-from itertools import groupby
+from itertools import groupby, chain
+from collections import Counter
+from heapq import merge, nlargest
+from operator import itemgetter
 from time import time, sleep
-from os import getpid
-from pickle import dump
-from typing import List, Generator, Dict, Union, Tuple, Pattern
-from multiprocessing import Process, Value, Array, Lock, Pipe, current_process
+from os import getpid, getcwd, chdir, fstat, stat, scandir, listdir, makedirs, unlink, cpu_count, kill, dup2, devnull
+import sys
+from os.path import abspath, join, exists, getsize, isfile
+from stat import S_ISREG
+from mmap import mmap, ACCESS_READ
+from array import array
+from bisect import bisect_left
+from codecs import getincrementaldecoder
+from io import BytesIO
+from importlib import import_module
+from struct import Struct, error as StructError
+from types import SimpleNamespace
+from typing import List, Generator, Dict, Union, Tuple, Pattern, TextIO, BinaryIO, Iterable, TYPE_CHECKING
 from math import ceil
-from re import findall, compile
+from functools import partial
+from re import findall, fullmatch, compile, escape
 from argparse import ArgumentParser
 from unicodedata import category, normalize
-from signal import signal, SIGINT
-from threading import Thread
-
-from colorama import Fore, Style, init
-init() # Inicialização colorama
+from signal import signal, default_int_handler, SIGINT, SIGTERM, SIG_IGN
+from threading import Thread, Lock as ThreadLock
+from queue import Queue as ThreadQueue, Empty
+from fnmatch import fnmatch
+from shlex import split as shell_split
+from contextlib import redirect_stdout, redirect_stderr, nullcontext
+
+# Os módulos usados apenas por algumas opções são importados quando são precisos, para um arranque mais rápido:
+# multiprocessing (processos filhos e modo servidor), socket e json (modo servidor), gzip, bz2 e lzma (ficheiros
+# comprimidos), tempfile e shutil (opções -n e --top), hashlib (--index) e cProfile (--profile)
+if TYPE_CHECKING:
+    from multiprocessing import Process, Queue, Array
+    from multiprocessing.pool import Pool
+    from cProfile import Profile
+
+# Cores vazias, usadas quando a saída não é um terminal
+COLORS = ('BLACK', 'RED', 'GREEN', 'YELLOW', 'BLUE', 'MAGENTA', 'CYAN', 'WHITE')
+PLAIN_FORE = SimpleNamespace(RESET='', **{ color: '' for color in COLORS }, **{ f'LIGHT{color}_EX': '' for color in COLORS })
+PLAIN_STYLE = SimpleNamespace(RESET_ALL='', BRIGHT='', DIM='', NORMAL='')
+
+# Cores apenas quando o stdout é um terminal: caso contrário (e.g. redirecionado para um ficheiro ou para outro
+# programa), o colorama não é importado e as cores são strings vazias. No modo servidor, as cores de cada pedido
+# dependem do terminal do cliente (ver handle_request)
+if sys.stdout.isatty():
+    from colorama import Fore, Style, init
+    init() # Inicialização colorama
+else:
+    Fore, Style = PLAIN_FORE, PLAIN_STYLE
+
+from historico import append_run, last_run, check as check_history
 
 # Transforma segundos em microsegundos
 to_micro = lambda s: int(s * 1000000)
@@ -25,7 +63,7 @@ dic_files_total = {}
 """
 
 dic_files_done = {}
-""" dic_files_done
+""" dic_files_done (recebido de cada filho apenas no fim)
     Chave: pid
     Valor: List
         Valor: Dict
@@ -36,81 +74,179 @@ dic_files_done = {}
                   end: int,
                   lines: int },
               duration: float }
+    Os tempos de cada fase da parcela estão em file['timings'] (ver PHASES)
+"""
+
+dic_process_timings = {}
+""" dic_process_timings (recebido de cada filho apenas no fim)
+    Chave: pid
+    Valor: Dict com o tempo (em segundos) que o processo esteve à espera de parcelas (wait) e a enviar dados ao pai (ipc)
+"""
+
+process_timings = { 'wait': 0.0, 'ipc': 0.0 }
+""" process_timings
+    Tempos (em segundos) do próprio processo, enviados ao pai no fim (ver dic_process_timings)
+"""
+
+run_timings = {}
+""" run_timings
+    Tempo (em segundos) de cada fase da execução no processo pai: indexação (divisão dos ficheiros em parcelas),
+    criação dos processos, pesquisa (até todos os filhos terminarem) e junção dos resultados (opções -n e --top)
 """
 
-mutex = Lock()
-pipe_pai,pipe_filho = Pipe()
-total = Array('i', 3) # Inicialização do contador global das palavras (máx. 3 palavras)
-children_active = Value("i", 0)
+# Fases de cada parcela cujo tempo é medido: leitura (e descompressão), descodificação, remoção de diacríticos,
+# pesquisa (e escrita das linhas encontradas) e registo (e impressão) dos resultados
+PHASES = ('read', 'decode', 'fold', 'match', 'commit')
+
+binary_skipped = {}
+""" binary_skipped
+    Ficheiros binários ignorados (opção --binary-files skip), pela ordem em que foram encontrados
+    Chave: caminho
+    Valor: tamanho em bytes
+"""
+
+# Objetos partilhados pelo pai e pelos filhos, criados por share (sem processos filhos, são equivalentes locais)
+mutex = None
+results = None # Lista de dados dos ficheiros processados por cada filho (ver dic_files_done) e os seus tempos (ver dic_process_timings), enviados no fim
+lines_done = None # Parcelas cujas linhas encontradas já estão escritas em spill_dir (seq, quantidade de linhas), e um None por filho no fim
+
+spill_dir = None
+""" spill_dir
+    Diretoria temporária onde os filhos escrevem as linhas encontradas de cada parcela (opção -n), num ficheiro
+    com o nome seq da parcela. O processo pai escreve-as para o stdout pela ordem das parcelas (ver merge_lines).
+    Na opção --top, é onde cada processo escreve a sua tabela de palavras (ver spill_vocabulary).
+"""
+
+vocabulary = Counter()
+""" vocabulary
+    Tabela das palavras do processo na opção --top (ver count_vocabulary), escrita para spill_dir sempre
+    que ultrapassa VOCABULARY_MAX_WORDS palavras, e no fim
+    Chave: palavra (sem diacríticos)
+    Valor: quantidade de ocorrências
+"""
+
+# Colunas da tabela de progresso antes dos contadores das palavras
+PROGRESS_BYTES, PROGRESS_LINES, PROGRESS_FILES, PROGRESS_WORDS = range(4)
+
+progress = None
+""" progress
+    Tabela de progresso, em memória partilhada (Array de inteiros de 64 bits sem Lock, criado no main, ver shared_array)
+    Uma linha por processo: o processo i só escreve na linha i e o processo pai soma as linhas (ver sum_progress)
+        Colunas: bytes processados, linhas processadas, ficheiros terminados, ocorrências/linhas de cada palavra
+"""
+
+files_left = None
+""" files_left
+    Quantidade de parcelas por processar de cada ficheiro (Array partilhado, com Lock, criado no main, ver shared_array)
+    O processo que processa a última parcela de um ficheiro conta-o como terminado
+    None com a opção -r (ver commit_progress)
+"""
+
+# Quantidade de processos a pesquisar (Value partilhado, criado por share)
+children_active = None
+
+# Linhas (ou ocorrências, com -c) que ainda podem ser encontradas com a opção -m, partilhadas por todos os processos
+# (Value partilhado, criado por share). Com a opção -n e processos filhos, apenas o pai as consome, pela ordem das parcelas
+# (ver merge_lines), e os filhos só as leem
+matches_left = None
 
 # Inicio execução
 inicio_execucao = time()
 
-def chunks(files: List[Tuple[str, int, List[int]]], total_lines: int, n: int) -> List[List[Dict[str, Union[str, int]]]]:
-    """
-    Separa ficheiros em n parcelas equitativamente
+# Tamanho (em bytes) dos blocos lidos de cada vez do ficheiro mapeado em memória
+BLOCK_SIZE = 4 * 1024 * 1024
+
+# Tamanho (aproximado) dos segmentos de cada bloco cujo conteúdo é classificado como ASCII ou não (ver ascii_segments)
+ASCII_SEGMENT = 64 * 1024
+
+# Quantidade de palavras diferentes que a tabela de cada processo guarda em memória, na opção --top (ver spill_vocabulary)
+VOCABULARY_MAX_WORDS = 1024 * 1024
+
+# Quantidade de threads que percorrem as diretorias da opção -r
+WALK_THREADS = 8
+
+# Formatos de compressão reconhecidos pelos primeiros bytes do ficheiro, e o módulo que abre cada um (ver open_compressed)
+COMPRESSION_MAGIC = { b'\x1f\x8b': 'gzip', b'BZh': 'bz2', b'\xfd7zXZ\x00': 'xz' }
+COMPRESSION_MODULE = { 'gzip': 'gzip', 'bz2': 'bz2', 'xz': 'lzma' }
+# Exceção de cada módulo para dados corrompidos (o bz2 não tem uma própria e usa OSError, ver compression_errors)
+COMPRESSION_ERROR = { 'gzip': 'BadGzipFile', 'xz': 'LZMAError' }
+
+# Bytes lidos do início de cada ficheiro para o classificar como binário (ver is_binary)
+SNIFF_SIZE = 8 * 1024
+
+# Intervalo (em segundos) entre verificações do tamanho dos ficheiros no modo --follow
+FOLLOW_INTERVAL = 1
 
-    :param files: Lista de tuplos em que a primeira posição representa o caminho do ficheiro, a segunda a quantidade de linhas, e a última a lista de posições do inicio da linha i
-    :param total_lines: Quantidade total de linhas
+# Tempo máximo (em segundos) à espera de uma mensagem dos filhos antes de verificar se ainda estão vivos (ver messages)
+CHILD_POLL = 0.5
+
+# Tamanho total (em bytes) dos ficheiros (não comprimidos) até ao qual a pesquisa é feita no próprio processo, sem processos filhos
+# nem divisão dos ficheiros, qualquer que seja a opção -p: criar os processos custaria mais que a pesquisa
+FAST_PATH_SIZE = 256 * 1024
+
+# Cabeçalho dos índices de linhas em cache: identificador, tamanho, mtime (ns) e inode do ficheiro, quantidade de linhas
+INDEX_MAGIC = b'PGIX'
+INDEX_HEADER = Struct('=4s4xQqQQ')
+
+# Motor de pesquisa: palavras, índice de cada palavra e expressões regulares (ver compile_matcher e compile_vocabulary)
+Matcher = Dict[str, Union[Tuple[str], Dict[str, int], Pattern, List[Tuple[str, Pattern]]]]
+
+def chunks(files: List[Tuple[str, int, int, str]], total_size: int, n: int) -> List[List[Dict[str, Union[str, int]]]]:
+    """
+    Separa ficheiros em n parcelas equitativamente, pela quantidade de bytes.
+    Os limites das parcelas não coincidem necessariamente com o início de uma linha: cada processo
+    ajusta-os ao início da linha seguinte (ver read_file e read_blocks).
+
+    :param files: Lista de tuplos em que a primeira posição representa o caminho do ficheiro, as seguintes o início e o fim
+                  (em bytes) do intervalo a pesquisar (normalmente, o ficheiro inteiro; podem existir vários intervalos do mesmo ficheiro)
+                  e a última o formato de compressão (None se não for comprimido). Os ficheiros comprimidos não são divididos.
+    :param total_size: Quantidade total de bytes
     :param n: Quantidade de parcelas a dividir
-    :return: Lista das n parcelas
+    :return: Lista das (até) n parcelas
             A lista interior representa j ficheiros na parcela i
-            A lista mais interior representa o caminho do ficheiro, a posição em que irá começar, a posição em que irá acabar, e as quntidade de linhas desta divisão
+            A lista mais interior representa o caminho do ficheiro, a posição em que irá começar, a posição em que irá acabar, e as quntidade de linhas desta divisão (calculada pelo processo)
     """
-    file_idx = 0
-    file_lines = 0
-
-    lines_each = ceil(total_lines / n)
+    size_each = ceil(total_size / n)
 
-    res = [
-        [ { 'path': files[file_idx][0],
-              'start': 0,
-              'end': files[file_idx][2][-1],
-              'lines': 0 } ]
-    ]
+    res = [ [] ]
     """
     [
         [ processo_i
             { ficheiro_j
-                path: str, start: int, end: int, lines: int 
+                path: str, file_id: int, seq: int, start: int, end: int, lines: int
+                (com a opção --index, também line: int, o índice da primeira linha, ver align_chunks)
             }
         ]
     ]
     """
-
-    # Enquanto o ficheiro não tiver sido totalmente atribuido
-    while file_idx < len(files) and file_lines < files[file_idx][1]:
-        to_add = min(lines_each, files[file_idx][1] - file_lines)
-
-        file_lines += to_add
-        res[-1][-1]['lines'] += to_add
-
-        eof = file_lines >= files[file_idx][1]
-        if not eof:
-            res[-1][-1]['end'] = files[file_idx][2][file_lines]
-
-        next_process = res[-1][-1]['lines'] >= lines_each
-        # Passar ao próximo ficheiro
-        if eof:
-            file_lines = 0
-            file_idx += 1
-            if not next_process and file_idx < len(files):
-                res[-1].append(
-                    { 'path': files[file_idx][0],
-                      'start': 0,
-                      'end': files[file_idx][2][-1],
-                      'lines': 0 } )
-
-        # Passar ao próximo processo
-        if next_process and file_idx < len(files):
-            res.append(
-                [
-                    {'path': files[file_idx][0],
-                     'start': files[file_idx][2][file_lines],
-                     'end': files[file_idx][2][-1],
-                     'lines': 0 }
-                ]
-            )
+    assigned = 0 # Bytes atribuídos ao processo atual
+    seq = 0 # Posição da parcela na ordem dos ficheiros (e dentro de cada ficheiro)
+
+    file_ids = {} # Identificador de cada ficheiro (o mesmo para todos os intervalos do ficheiro)
+    for path, start, size, compression in files:
+        file_id = file_ids.setdefault(path, len(file_ids))
+        # Enquanto o intervalo não tiver sido totalmente atribuido
+        while start < size:
+            # Passar ao próximo processo
+            if assigned >= size_each:
+                res.append([])
+                assigned = 0
+
+            # Não é possível começar a ler um ficheiro comprimido a meio
+            to_add = size - start if compression else min(size_each - assigned, size - start)
+            res[-1].append(
+                { 'path': path,
+                  'file_id': file_id,
+                  'seq': seq,
+                  'start': start,
+                  'end': start + to_add,
+                  'lines': 0 } )
+            if compression:
+                res[-1][-1]['compression'] = compression
+
+            seq += 1
+            start += to_add
+            assigned += to_add
 
     return res
 
@@ -128,27 +264,130 @@ def read_list(text: str) -> List[str]:
         inp = input()
         files += f' {inp}'
 
-    # Partir os valores pelo espaço
-    return files.split()
+    # Partir os valores pelo espaço (caminhos com espaços entre aspas, como na shell)
+    try:
+        return shell_split(files)
+    except ValueError:
+        # Aspas por fechar (e.g. it's.txt): sem aspas, os caminhos são partidos apenas pelo espaço
+        return files.split()
 
-def file_lines_pos(path: str) -> Tuple[int, List[int]]:
+def line_starts(m: mmap, start: int, size: int) -> array:
     """
-    Em que posição começa a linha i
-    :param path: Caminho do ficheiro
-    :return: Lista das posições do início da linha i do ficheiro
+    Em que posição (em bytes) começam as linhas entre start e size
+    :param m: Ficheiro mapeado em memória
+    :param start: Posição a partir da qual procurar
+    :param size: Tamanho do ficheiro
+    :return: Array das posições do início de cada linha em [start, size)
+    """
+    offsets = array('Q', [0] if start == 0 else [])
+
+    # Uma quebra de linha na posição p (antes do fim do ficheiro) inicia uma linha em p+1
+    newline = m.find(b'\n', max(start - 1, 0), size - 1)
+    while newline != -1:
+        offsets.append(newline + 1)
+        newline = m.find(b'\n', newline + 1, size - 1)
+
+    return offsets
+
+def load_index(path: str, cache_dir: str) -> memoryview:
+    """
+    Obtém o índice das posições do início de cada linha de um ficheiro, guardado em cache_dir.
+    O índice é válido enquanto o tamanho, o mtime e o inode do ficheiro não mudarem; se o ficheiro
+    apenas cresceu (mesmo inode), o índice é estendido a partir da última posição conhecida.
+    Caso contrário, é reconstruído.
+
+    :param path: Caminho do ficheiro (não vazio)
+    :param cache_dir: Diretoria dos índices
+    :return: Posições do início da linha i do ficheiro (mapeadas em memória)
     """
-    line_offset = []
-    offset = 0
+    from hashlib import sha1
 
+    st = stat(path)
+    index_path = join(cache_dir, f'{sha1(abspath(path).encode()).hexdigest()}.idx')
+
+    header = None
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line_offset.append(offset)
-                offset += len(line)
-    except Exception as err:
-        print(f'{Fore.LIGHTRED_EX}Ficheiro {path}: {err}{Fore.RESET}')
+        with open(index_path, 'rb') as f:
+            header = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+    except (OSError, StructError):
+        pass
+
+    if header is None or header[0] != INDEX_MAGIC:
+        # Índice inexistente ou inválido: construir do início
+        start, count = 0, 0
+    else:
+        _, size, mtime, inode, count = header
+        if (size, mtime, inode) == (st.st_size, st.st_mtime_ns, st.st_ino):
+            start = None
+        elif inode == st.st_ino and size < st.st_size:
+            # Ficheiro estendido (e.g. log): continuar a partir do fim anterior
+            start = size
+        else:
+            start, count = 0, 0
+
+    if start is not None:
+        with open(path, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as m:
+            size = len(m)
+            offsets = line_starts(m, start, size)
+
+        try:
+            makedirs(cache_dir, exist_ok=True)
+            with open(index_path, 'r+b' if count else 'wb') as f:
+                f.seek(INDEX_HEADER.size + count * offsets.itemsize)
+                offsets.tofile(f)
+                f.truncate()
+                f.seek(0)
+                f.write(INDEX_HEADER.pack(INDEX_MAGIC, size, st.st_mtime_ns, st.st_ino, count + len(offsets)))
+        except OSError as err:
+            # Não foi possível guardar o índice: é usado apenas nesta execução (construído do início)
+            print(f'{Fore.LIGHTRED_EX}Índice {index_path}: {err}{Fore.RESET}')
+            if count:
+                with open(path, 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as m:
+                    offsets = line_starts(m, 0, size)
+            return memoryview(offsets)
+
+    with open(index_path, 'rb') as f:
+        m = mmap(f.fileno(), 0, access=ACCESS_READ)
+
+    # A memoryview mantém o mmap aberto enquanto for usada
+    return memoryview(m)[INDEX_HEADER.size:].cast('Q')
+
+def make_index_dir(path: str) -> str:
+    """
+    Cria (se ainda não existir) a diretoria dos índices de linhas da opção --index.
+    :param path: Caminho da diretoria
+    :return: O mesmo caminho
+    """
+    try:
+        makedirs(path, exist_ok=True)
+    except OSError as err:
+        raise UserWarning(f'Argument --index: cannot create directory {path} ({err.strerror}).')
+    return path
+
+def align_chunks(chunked_files: List[List[Dict[str, Union[str, int]]]], indexes: Dict[str, memoryview], sizes: Dict[str, int]) -> None:
+    """
+    Ajusta os limites das parcelas ao início das linhas, com os índices dos ficheiros, e preenche
+    a quantidade de linhas de cada parcela e o índice ('line') da sua primeira linha no ficheiro.
+    Um limite dentro da última linha do ficheiro passa para o fim do ficheiro.
 
-    return len(line_offset), line_offset
+    :param chunked_files: Parcelas criadas por chunks (alteradas no lugar)
+    :param indexes: Dicionário com o índice de cada ficheiro
+    :param sizes: Dicionário com o tamanho (em bytes) de cada ficheiro
+    """
+    for process in chunked_files:
+        for file in process:
+            # Os ficheiros comprimidos não têm índice (são sempre lidos por inteiro)
+            if file['path'] not in indexes:
+                continue
+
+            offsets = indexes[file['path']]
+            first = bisect_left(offsets, file['start'])
+            last = bisect_left(offsets, file['end'])
+
+            file['start'] = offsets[first] if first < len(offsets) else sizes[file['path']]
+            file['end'] = offsets[last] if last < len(offsets) else sizes[file['path']]
+            file['line'] = first
+            file['lines'] = last - first
 
 def strip_accents(s: str) -> str:
     """
@@ -160,37 +399,189 @@ def strip_accents(s: str) -> str:
     return ''.join(c for c in normalize('NFD', s)
                   if category(c) != 'Mn')
 
+# Tabela de tradução dos caracteres latinos não ASCII (até U+024F) que têm diacríticos
+ACCENTS_TABLE = { c: strip_accents(chr(c)) for c in range(0x80, 0x250) if strip_accents(chr(c)) != chr(c) }
+
+# Caracteres não cobertos pela ACCENTS_TABLE (e.g. diacríticos soltos, outros alfabetos)
+NOT_IN_TABLE = compile('[^\x00-\u024f]')
+
+# Palavras da opção --top: as sequências delimitadas por \b, como nas palavras pesquisadas
+WORD_REGEX = compile(r'\w+')
+
+# Quebra de linha, procurada com uma expressão regular nos blocos (memoryview), que não têm find (ver ascii_segments)
+NEWLINE = compile(b'\n')
+
+def fold_accents(s: str) -> str:
+    """
+    Remove acentos e outros caracteres (diacríticos) da string s, com o mesmo resultado que strip_accents.
+    Texto ASCII é devolvido sem alterações e texto latino é convertido com a ACCENTS_TABLE; apenas
+    os restantes caracteres passam pela normalização completa de strip_accents.
+
+    :param s: String a remover os caracteres.
+    :return: String sem os caracteres.
+    """
+    if s.isascii():
+        return s
+
+    s = s.translate(ACCENTS_TABLE)
+    if NOT_IN_TABLE.search(s) is None:
+        return s
+
+    return strip_accents(s)
+
+def timed(items: Iterable, timings: Dict[str, float], phase: str) -> Generator:
+    """
+    Gera os elementos de items, somando a timings[phase] o tempo gasto a obtê-los.
+    :param items: Iterável (normalmente, um gerador que lê um ficheiro)
+    :param timings: Dicionário com os tempos de cada fase
+    :param phase: Fase a que o tempo é somado
+    :return: Gerador dos elementos de items
+    """
+    items = iter(items)
+    while True:
+        inicio = time()
+        try:
+            item = next(items)
+        except StopIteration:
+            return
+        finally:
+            timings[phase] += time() - inicio
+        yield item
+
 def read_file(file: Dict[str, Union[str, int]]) -> Generator[str, None, None]:
     """
-    Lê um ficheiro do caminho file['path'] começando em file['start'] e acabando em file['end']
+    Lê as linhas de um ficheiro do caminho file['path'] que começam entre file['start'] e file['end'] (exclusive)
 
-    :param file: Dicionário com o path, o start e o end de um ficheiro
+    :param file: Dicionário com o path, o start e o end (em bytes) de um ficheiro
     :return: Gerador das linhas do ficheiro.
     """
+    if file.get('compression'):
+        for block in read_compressed(file):
+            # Apenas '\n' separa as linhas, como nos ficheiros não comprimidos (o splitlines também parte em '\r', '\x0c', ...)
+            for line in BytesIO(block):
+                yield line.decode('utf-8', 'replace')
+        return
+
     offset = file['start']
-    with open(file['path'], 'r', encoding='utf-8') as f:
-        try:
-            while True:
-                # tem fim e chega a esse fim
-                if offset > file['end']:
-                    break
+    with open(file['path'], 'rb') as f:
+        # Começar na primeira linha que comece em file['start'] ou depois
+        # (com a opção --index, file['start'] já é o início de uma linha, ver align_chunks)
+        if file.get('line') is not None:
+            f.seek(offset, 0)
+        elif offset > 0:
+            f.seek(offset - 1, 0)
+            f.readline()
+            offset = f.tell()
+
+        while True:
+            # tem fim e chega a esse fim
+            if offset >= file['end']:
+                break
+
+            line = f.readline()
+            if line:
+                offset += len(line)
+                yield line.decode('utf-8', 'replace')
+            else:
+                break
 
-                f.seek(offset, 0)
-                line = f.readline()
-                if line:
-                    offset += len(line)
-                    yield line
-                else:
-                    break
-        except Exception as err:
-            f.seek(f.tell()+1, 0)
+def read_blocks(file: Dict[str, Union[str, int]]) -> Generator[Union[bytes, memoryview], None, None]:
+    """
+    Lê as linhas de um ficheiro do caminho file['path'] que começam entre file['start'] e file['end'] (exclusive),
+    em blocos de cerca de BLOCK_SIZE bytes. O ficheiro é mapeado em memória e cada bloco acaba no fim de uma linha.
+    Os blocos não são descodificados nem copiados: são vistas (memoryview) do ficheiro mapeado (ver search_blocks).
 
-def parse() -> Dict[str, Union[str, int, bool, Tuple[str]]]:
+    :param file: Dicionário com o path, o start e o end (em bytes) de um ficheiro
+    :return: Gerador dos blocos (conjuntos de linhas inteiras) do ficheiro (em bytes, nos ficheiros comprimidos).
+    """
+    if file.get('compression'):
+        yield from read_compressed(file)
+        return
+
+    start, chunk_end = file['start'], file['end']
+    with open(file['path'], 'rb') as f:
+        size = fstat(f.fileno()).st_size
+        # Não é possível mapear ficheiros vazios
+        if start >= min(chunk_end, size):
+            return
+
+        # O mmap não é fechado aqui: os blocos (memoryview) mantêm-no aberto enquanto forem usados
+        m = mmap(f.fileno(), 0, access=ACCESS_READ)
+
+    view = memoryview(m)
+    # Ajustar os limites ao início da linha seguinte (a não ser que já coincidam com um início de linha,
+    # como acontece sempre com a opção --index, ver align_chunks)
+    if file.get('line') is None:
+        if start > 0:
+            start = m.find(b'\n', start - 1) + 1 or size
+        if chunk_end < size:
+            chunk_end = m.find(b'\n', chunk_end - 1) + 1 or size
+
+    while start < chunk_end:
+        end = min(start + BLOCK_SIZE, chunk_end)
+        if end < chunk_end:
+            # Acabar o bloco no fim da última linha completa (ou da linha seguinte, se for maior que o bloco)
+            newline = m.rfind(b'\n', start, end)
+            if newline == -1:
+                newline = m.find(b'\n', end, chunk_end)
+            end = chunk_end if newline == -1 else newline + 1
+
+        yield view[start:end]
+        start = end
+
+def open_compressed(path: str, compression: str) -> BinaryIO:
+    """
+    Abre um ficheiro comprimido para leitura (o módulo do formato só é importado na primeira vez).
+    :param path: Caminho do ficheiro
+    :param compression: Formato de compressão (ver detect_compression)
+    :return: Ficheiro descomprimido à medida que é lido
+    """
+    return import_module(COMPRESSION_MODULE[compression]).open(path, 'rb')
+
+def compression_errors(compression: str) -> Tuple[type, ...]:
+    """
+    Obtém as exceções de um ficheiro comprimido corrompido ou truncado, a partir do módulo do formato
+    (sem importar os módulos dos outros formatos).
+    :param compression: Formato de compressão (ver detect_compression)
+    :return: Tuplo das exceções
+    """
+    module = import_module(COMPRESSION_MODULE[compression])
+    return (EOFError, getattr(module, COMPRESSION_ERROR[compression]) if compression in COMPRESSION_ERROR else OSError)
+
+def read_compressed(file: Dict[str, Union[str, int]]) -> Generator[bytes, None, None]:
+    """
+    Lê as linhas de um ficheiro comprimido (inteiro), descomprimido à medida que é lido,
+    em blocos de cerca de BLOCK_SIZE bytes que acabam no fim de uma linha.
+
+    :param file: Dicionário com o path e a compression de um ficheiro
+    :return: Gerador dos blocos (conjuntos de linhas inteiras) do ficheiro descomprimido, em bytes.
+    """
+    errors = compression_errors(file['compression']) + (OSError,)
+
+    rest = b'' # Última linha (incompleta) do bloco anterior
+    try:
+        with open_compressed(file['path'], file['compression']) as f:
+            while data := f.read(BLOCK_SIZE):
+                data = rest + data
+                newline = data.rfind(b'\n') + 1
+                rest = data[newline:]
+                if newline:
+                    yield data[:newline]
+    except errors as err:
+        # Ficheiro comprimido corrompido ou truncado: é pesquisado apenas o que foi possível descomprimir
+        print(f'{Fore.LIGHTRED_EX}Ficheiro {file["path"]}: {err}{Fore.RESET}')
+
+    if rest:
+        yield rest
+
+def parse(argv: List[str] = None, stdin: bool = True) -> Dict[str, Union[str, int, bool, Tuple[str]]]:
     """
     Define o parser de argumentos.
+    :param argv?: Lista de argumentos. Por omissão, os argumentos da linha de comandos.
+    :param stdin?: Bool cujo False representa que os ficheiros não podem ser pedidos no stdin (ver validate_args).
     :return: Dict com valores dos argumentos escolhidos pelo utilizador.
     """
-    parser = ArgumentParser(description='Pesquisa até três palavras em pelo menos um ficheiro, \
+    parser = ArgumentParser(description='Pesquisa palavras em pelo menos um ficheiro, \
                                             devolvendo as linhas que contêm unicamente uma das \
                                             ou todas as palavras. Conta e pesquisa paralelamente \
                                             os números de ocorrências de cada palavra e de linhas \
@@ -211,56 +602,154 @@ def parse() -> Dict[str, Union[str, int, bool, Tuple[str]]]:
                                         Caso a opção -a não esteja ativa, o número de linhas \
                                         devolvido é por palavra.')
 
+    mutually_exclusive.add_argument('-n', '--print-lines', action='store_true',
+                                    help='Opção que imprime as linhas devolvidas (ficheiro:linha:texto), pela ordem \
+                                        dos ficheiros e das linhas, em vez do número de ocorrências ou de linhas.')
+
+    mutually_exclusive.add_argument('--top', type=int, metavar='K',
+                                    help='Opção que conta todas as palavras dos ficheiros (sem diacríticos) e imprime \
+                                        as K mais frequentes, em vez de pesquisar palavras dadas.')
+
+    parser.add_argument('-m', '--max-count', type=int, default=0,
+                        help='Opção que termina a pesquisa de todos os processos assim que forem encontradas \
+                            N linhas (ou N ocorrências, com a opção -c), no total. O limite é verificado linha a linha: \
+                            com -c, a última linha aceite conta com todas as suas ocorrências, logo o total pode passar N. \
+                            Com paralelização, não são necessariamente as primeiras N linhas dos ficheiros.')
+
     parser.add_argument('-p', '--parallelization', type=int, default=0,
                         help='Opção que permite definir o nível de paralelização n do comando. \
                             Por omissão, não há paralelização.')
 
-    parser.add_argument('palavras', nargs='+',
-                        help='As palavras a pesquisar no conteúdo dos ficheiros. \
-                            Máximo 3 palavras.')
+    parser.add_argument('palavras', nargs='*',
+                        help='As palavras a pesquisar no conteúdo dos ficheiros (exceto na opção --top).')
 
     parser.add_argument('-f', '--files', nargs='+',
                         help='Ficheiro(s), sobre o(s) qual(is) é efetuada a pesquisa e contagem. \
                             Por omissão, o comando pede o(s) ficheiro(s) ao utilizador.')
 
+    parser.add_argument('-r', '--recursive', action='append', metavar='DIR',
+                        help='Diretoria pesquisada recursivamente (além dos ficheiros de -f). Pode ser repetida. Os \
+                            ficheiros são divididos pelos processos à medida que são encontrados, com escalonamento dynamic.')
+
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help='Com a opção -r, pesquisa apenas os ficheiros cujo nome respeita o padrão GLOB \
+                            (e.g. "*.log"). Pode ser repetida.')
+
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help='Com a opção -r, ignora os ficheiros e as diretorias cujo nome respeita o padrão GLOB \
+                            (e.g. ".git"). Pode ser repetida.')
+
+    parser.add_argument('--binary-files', choices=('skip', 'text'), default='skip',
+                        help='Tratamento dos ficheiros binários (com o byte NUL ou UTF-8 inválido nos primeiros 8 KiB). \
+                            Com skip, são ignorados (e contados no resumo e no histórico). Com text, são pesquisados \
+                            como texto. Por omissão, skip.')
+
     parser.add_argument('-w', '--interval', type=int, default=0,
                         help='Define o intervalo de tempo s em que o estado da contagem de \
                              linhas ou ocorrências é escrito.')
 
     parser.add_argument('-o', '--output', type=str,
-                        help='Define o ficheiro file que guarda o histórico da execução do programa em binário.')
-
-    args = parser.parse_args().__dict__
+                        help='Define o ficheiro file que guarda o histórico da execução do programa em binário. \
+                            Cada execução é acrescentada ao fim do ficheiro (ver historico.py).')
+
+    parser.add_argument('--follow', action='store_true',
+                        help='Depois da pesquisa, continua a pesquisar apenas as linhas acrescentadas aos ficheiros \
+                            (verificados a cada segundo), até ao CTRL+C. Um ficheiro rodado ou truncado volta a ser \
+                            pesquisado desde o início.')
+
+    parser.add_argument('--resume', action='store_true',
+                        help='Retoma uma execução interrompida a partir do histórico dado com a opção -o: apenas \
+                            são pesquisados os intervalos dos ficheiros que ainda não tinham sido terminados, e os \
+                            resultados são juntos aos da última execução do histórico, e acrescentados no fim.')
+
+    parser.add_argument('--profile', type=str, metavar='DIR',
+                        help='Escreve o perfil (cProfile) de cada processo que pesquisa na diretoria DIR, no ficheiro \
+                            <pid>.prof (para ler com o módulo pstats). Os tempos de cada fase são sempre guardados \
+                            no histórico da opção -o.')
+
+    parser.add_argument('-s', '--scheduler', choices=('static', 'dynamic'), default='static',
+                        help='Escalonamento do trabalho pelos processos filhos. Com static, cada processo recebe \
+                            uma parcela fixa dos ficheiros. Com dynamic, os ficheiros são divididos em várias \
+                            tarefas pequenas, numa fila partilhada, e cada processo retira a próxima tarefa \
+                            quando acaba a anterior. Por omissão, static.')
+
+    parser.add_argument('--task-size', type=int, default=BLOCK_SIZE,
+                        help='Tamanho (em bytes) de cada tarefa do escalonamento dynamic. \
+                            Por omissão, 4 MiB.')
+
+    parser.add_argument('--index', type=str,
+                        help='Diretoria onde são guardados os índices das linhas de cada ficheiro, reutilizados \
+                            em execuções seguintes enquanto os ficheiros não mudarem. Com esta opção, as parcelas \
+                            de cada processo começam e acabam no início de uma linha e o número da primeira linha \
+                            de cada parcela (opção -n) é conhecido de antemão.')
+
+    parser.add_argument('--daemon', type=str, metavar='SOCKET',
+                        help='Inicia o pgrepwc em modo servidor, no socket Unix SOCKET, com um conjunto de -p \
+                            processos (por omissão, um por CPU) sempre ativos. As pesquisas são pedidas com \
+                            o cliente cpgrepwc.py. Nesta opção, não são indicadas palavras nem ficheiros.')
+
+    args = parser.parse_args(argv).__dict__
 
     # Args is passed as reference!!
-    validate_args(args)
+    validate_args(args, stdin)
 
     return args
 
-def validate_args(args: Dict[str, Union[str, int, bool, List[str]]]) -> None:
+def validate_args(args: Dict[str, Union[str, int, bool, List[str]]], stdin: bool = True) -> None:
     """
     Valida argumentos e remove duplicados.
     :param args: Dicionário com argumentos por validar.
+    :param stdin?: Bool cujo False representa que os ficheiros não podem ser pedidos no stdin (modo servidor),
+                   pelo que -f ou -r são obrigatórios.
     """
     # Remover duplicados
-    args['palavras'] = tuple(set(strip_accents(word) for word in args['palavras']))
+    # (pela ordem dada, para que o resultado seja determinístico)
+    args['palavras'] = tuple(dict.fromkeys(strip_accents(word) for word in args['palavras']))
 
     # Impor limites
-    if len(args['palavras']) > 3:
-        raise UserWarning('Argument palavras must not be longer than 3.')
-
     if args['parallelization'] < 0:
         raise UserWarning('Argument -p must not be smaller than 0.')
 
-    # Obter ficheiros do stdin
+    if args['max_count'] < 0:
+        raise UserWarning('Argument -m must not be smaller than 0.')
+
+    if args['top'] is None and not args['palavras']:
+        raise UserWarning('At least one word is required (except with --top).')
+
+    if args['top'] is not None:
+        if args['top'] <= 0:
+            raise UserWarning('Argument --top must be greater than 0.')
+
+        if args['palavras']:
+            raise UserWarning('Argument --top does not take words.')
+
+        if args['all'] or args['max_count'] or args['resume'] or args['follow']:
+            raise UserWarning('Argument --top cannot be used with -a, -m, --resume or --follow.')
+
+    if args['resume'] and not args['output']:
+        raise UserWarning('Argument --resume requires -o.')
+
+    if args['resume'] and args['print_lines']:
+        raise UserWarning('Argument --resume cannot be used with -n.')
+
+    if args['task_size'] <= 0:
+        raise UserWarning('Argument --task-size must be greater than 0.')
+
+    if (args['include'] or args['exclude']) and not args['recursive']:
+        raise UserWarning('Arguments --include and --exclude require -r.')
+
+    # Obter ficheiros do stdin (com a opção -r, os ficheiros são encontrados nas diretorias)
     if args['files'] is None:
-        args['files'] = read_list('Insira o(s) ficheiro(s) a pesquisar: ')
+        if not args['recursive'] and not stdin:
+            raise UserWarning('Argument -f or -r is required in daemon mode.')
+
+        args['files'] = [] if args['recursive'] else read_list('Insira o(s) ficheiro(s) a pesquisar: ')
 
     # Impor limites
-    args['files'] = tuple(set(args['files']))
+    args['files'] = tuple(dict.fromkeys(args['files']))
 
     # Import limites do parallelization
-    if args['parallelization'] > len(args['files']):
+    if not args['recursive'] and args['parallelization'] > len(args['files']):
         raise UserWarning(f'Argument -p must not be greater than file count ({len(args["files"])}).')
 
 def compile_words_regex(words: Tuple[str]) -> List[Tuple[str, Pattern]]:
@@ -273,65 +762,591 @@ def compile_words_regex(words: Tuple[str]) -> List[Tuple[str, Pattern]]:
     # usar o compile da biblioteca re para melhor desempenho, ao invés de definir o regex das palavras em cada linha de cada ficheiro
     return [ (word, compile(f'\\b{word}\\b')) for word in words ]
 
-def search_file(file: Dict[str, Union[str, int]], words: List[Tuple[str, Pattern]], all_words: bool) -> Dict[str, Dict[int, int]]:
+def words_trie(words: Tuple[str]) -> str:
     """
-    Pesquisa e conta ocorrências de dada(s) palavra(s) num ficheiro.
-    :param path: String com o caminho do ficheiro.
-    :param words: Lista de tuplos com pares String palavra e a sua Pattern
-                  expressão regular a pesquisar/contar.
-    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
-                      contabilizar linhas com todas as palavras dadas.
-    :return: Dicionário com as ocorrências de cada palavra por linha.
+    Constrói uma expressão regular equivalente à alternância das palavras, organizada como uma trie
+    (prefixos comuns partilhados), para que o custo de cada posição não cresça com o número de palavras.
+
+    :param words: Tuplo de Strings com palavras (não vazias).
+    :return: String com a expressão regular (sem grupos de captura).
     """
-    # Dicionário das ocorrências das palavras em cada linha
-    occurrences = { word: {} for word, _ in words }
-    """ occurrences
-        Chave: palavra
-        Valor: Dict
-                Chave: índice da linha
-                Valor: Quantidade de ocorrências [da palavra] nessa linha
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        # Marca de fim de palavra
+        node[''] = {}
+
+    def build(node: Dict[str, Dict]) -> str:
+        branches = [ escape(c) + build(child) for c, child in node.items() if c ]
+        if not branches:
+            return ''
+
+        regex = branches[0] if len(branches) == 1 else f'(?:{"|".join(branches)})'
+        # Se uma palavra acaba neste nó, o resto é opcional
+        return f'(?:{regex})?' if '' in node else regex
+
+    return build(trie)
+
+def compile_matcher(words: Tuple[str]) -> Matcher:
     """
+    Compila as palavras num único motor de pesquisa, que encontra todas as palavras numa só passagem pela linha.
 
-    # For each line of file
-    for i, line in enumerate(read_file(file)):
+    Se todas as palavras só tiverem caracteres \\w, a alternância \\b(p1|p2|...)\\b (em forma de trie, ver
+    words_trie) encontra as mesmas ocorrências que cada \\bpalavra\\b em separado, qualquer que seja o número
+    de palavras. Caso contrário, usa-se uma expressão regular por palavra.
+
+    Se, além disso, todas as palavras forem ASCII, a mesma expressão regular é também compilada em bytes, para
+    pesquisar diretamente os segmentos ASCII dos ficheiros, sem os descodificar (ver search_blocks).
+
+    :param words: Tuplo de Strings com palavras a compilar.
+    :return: Dicionário com as palavras, o índice de cada palavra, a expressão regular combinada
+             (None se não for aplicável), a mesma em bytes (None se não for aplicável)
+             e as expressões regulares de cada palavra.
+    """
+    single_pass = all(fullmatch(r'\w+', word) for word in words)
+    regex = f'\\b({words_trie(words)})\\b'
+
+    return {
+        'words': words,
+        'index': { word: i for i, word in enumerate(words) },
+        'regex': compile(regex) if single_pass else None,
+        'bytes_regex': compile(regex.encode()) if single_pass and all(word.isascii() for word in words) else None,
+        'regexes': [] if single_pass else compile_words_regex(words),
+        'vocabulary': False
+    }
+
+def compile_vocabulary() -> Matcher:
+    """
+    Cria o motor de pesquisa da opção --top, que conta todas as palavras (ver count_vocabulary) em vez de palavras dadas.
+
+    :return: Dicionário com os mesmos campos de compile_matcher, sem palavras.
+    """
+    return {
+        'words': (),
+        'index': {},
+        'regex': WORD_REGEX,
+        'bytes_regex': None,
+        'regexes': [],
+        'vocabulary': True
+    }
+
+def count_words(matcher: Matcher, line: str) -> Union[List[int], None]:
+    """
+    Conta as ocorrências de cada palavra do matcher numa linha.
+
+    :param matcher: Motor de pesquisa criado por compile_matcher.
+    :param line: String com a linha (já sem diacríticos).
+    :return: Lista com a quantidade de ocorrências de cada palavra, pela ordem de matcher['words'],
+             ou None se nenhuma palavra ocorrer na linha.
+    """
+    if matcher['regex'] is None:
+        counts = [len(findall(regex, line)) for _, regex in matcher['regexes']]
+        return counts if any(counts) else None
+
+    found = matcher['regex'].findall(line)
+    if not found:
+        return None
+
+    index = matcher['index']
+    counts = [0] * len(index)
+    for word in found:
+        counts[index[word]] += 1
+    return counts
+
+def search_lines(file: Dict[str, Union[str, int]], matcher: Matcher) -> Generator[Tuple[int, List[int], str], None, None]:
+    """
+    Pesquisa as palavras linha a linha.
+
+    :param file: Dicionário com o path, o start e o end de um ficheiro
+    :param matcher: Motor de pesquisa criado por compile_matcher.
+    :return: Gerador de tuplos com o índice da linha, as ocorrências de cada palavra nessa linha e a linha original,
+             apenas para as linhas onde ocorre pelo menos uma palavra. No fim, file['lines'] tem a quantidade de linhas lidas.
+    """
+    lines = 0
+    # A leitura inclui a descodificação (linha a linha)
+    for i, line in enumerate(timed(read_file(file), file['timings'], 'read')):
+        lines += 1
         # Remove diacritics
-        normalized_line = strip_accents(line)
+        line_word_occurrences = count_words(matcher, fold_accents(line))
+        if line_word_occurrences is not None:
+            yield i, line_word_occurrences, line.rstrip('\n')
 
-        # Dicionário das ocorrências das palavras na linha i
-        line_word_occurrences = { word: 0 for word, _ in words }
-        """ line_word_occurrences
-            Chave: palavra
-            Valor: Quantidade de ocorrências [da palavra] na linha i
-        """
+    file['lines'] = lines
 
-        for word, regex in words:
-            # Guardar a quantidade de ocorrências da palavra word na linha i
-            line_word_occurrences[word] = len(findall(regex, normalized_line))
+def match_lines(text: Union[str, bytes], regex: Pattern, first_line: int) -> Generator[Tuple[int, int, int], None, None]:
+    """
+    Percorre um texto (str ou bytes) com uma expressão regular e obtém a linha de cada ocorrência,
+    sem repetir linhas: a linha só é delimitada à volta de cada ocorrência encontrada.
+
+    :param text: Conjunto de linhas inteiras
+    :param regex: Expressão regular do mesmo tipo que o texto
+    :param first_line: Índice da primeira linha do texto
+    :return: Gerador de tuplos com o índice, o início e o fim (sem a quebra de linha) de cada linha com ocorrências.
+    """
+    newline = '\n' if isinstance(text, str) else b'\n'
+
+    i = first_line # Índice da linha em line_start
+    line_start = 0
+    match = regex.search(text)
+    while match:
+        # Limites da linha onde a palavra foi encontrada
+        pos = match.start()
+        i += text.count(newline, line_start, pos)
+        line_start = text.rfind(newline, line_start, pos) + 1
+        line_end = text.find(newline, pos)
+        if line_end == -1:
+            line_end = len(text)
+
+        yield i, line_start, line_end
+
+        # Continuar a pesquisa na linha seguinte
+        match = regex.search(text, line_end + 1)
+
+def ascii_segments(block: Union[bytes, memoryview]) -> Generator[bytes, None, None]:
+    """
+    Divide um bloco em segmentos de cerca de ASCII_SEGMENT bytes que acabam no fim de uma linha, para que
+    um carácter não ASCII obrigue a descodificar apenas o segmento onde está, e não o bloco inteiro.
+    Só os segmentos são copiados do ficheiro mapeado (ver read_blocks).
+
+    :param block: Conjunto de linhas inteiras
+    :return: Gerador dos segmentos (conjuntos de linhas inteiras) do bloco, em bytes.
+    """
+    start = 0
+    while start < len(block):
+        newline = NEWLINE.search(block, start + ASCII_SEGMENT - 1)
+        end = newline.end() if newline else len(block)
+        yield bytes(block[start:end])
+        start = end
+
+def search_blocks(file: Dict[str, Union[str, int]], matcher: Matcher) -> Generator[Tuple[int, List[int], str], None, None]:
+    """
+    Pesquisa as palavras bloco a bloco. A expressão regular combinada percorre o bloco inteiro e
+    a linha (e o seu índice) só é obtida à volta de cada ocorrência encontrada (ver match_lines).
+
+    Com palavras ASCII (ver compile_matcher), os segmentos só com bytes ASCII são pesquisados em bytes, sem
+    descodificação nem remoção de diacríticos, que ficam apenas para os segmentos com outros caracteres
+    (onde um acento pode esconder, ou separar, uma palavra).
+
+    :param file: Dicionário com o path, o start e o end de um ficheiro
+    :param matcher: Motor de pesquisa criado por compile_matcher (com expressão regular combinada).
+    :return: Gerador de tuplos com o índice da linha, as ocorrências de cada palavra nessa linha e a linha original,
+             apenas para as linhas onde ocorre pelo menos uma palavra. No fim, file['lines'] tem a quantidade de linhas lidas.
+    """
+    regex, bytes_regex = matcher['regex'], matcher['bytes_regex']
+    timings = file['timings']
+    block_line = 0 # Índice da primeira linha do segmento
+    segment = b''
+
+    for raw in timed(read_blocks(file), timings, 'read'):
+        for segment in ascii_segments(raw) if bytes_regex is not None else (raw,):
+            if bytes_regex is not None and segment.isascii():
+                for i, line_start, line_end in match_lines(segment, bytes_regex, block_line):
+                    line = segment[line_start:line_end].decode('ascii')
+                    yield i, count_words(matcher, line), line
+
+                block_line += segment.count(b'\n')
+                continue
+
+            inicio = time()
+            block = str(segment, 'utf-8', 'replace')
+            decoded = time()
+            # Remove diacritics (não altera as quebras de linha)
+            folded = fold_accents(block)
+            timings['decode'] += decoded - inicio
+            timings['fold'] += time() - decoded
+
+            # A normalização completa (caracteres fora da ACCENTS_TABLE) pode mudar o comprimento de algumas linhas,
+            # mesmo que o total se mantenha (e.g. um acento solto removido numa linha e um carácter decomposto noutra),
+            # e as posições deixam de corresponder às do bloco original: nesse caso (raro), o bloco é pesquisado linha a linha
+            if len(folded) != len(block) or (NOT_IN_TABLE.search(block) is not None
+                                             and list(map(len, block.split('\n'))) != list(map(len, folded.split('\n')))):
+                for i, line in enumerate(block.split('\n'), block_line):
+                    line_word_occurrences = count_words(matcher, fold_accents(line))
+                    if line_word_occurrences is not None:
+                        yield i, line_word_occurrences, line
+            else:
+                for i, line_start, line_end in match_lines(folded, regex, block_line):
+                    yield i, count_words(matcher, folded[line_start:line_end]), block[line_start:line_end]
+
+            block_line += block.count('\n')
+
+    # A última linha do ficheiro pode não acabar com quebra de linha
+    file['lines'] = block_line + (1 if segment and segment[-1:] != b'\n' else 0)
+
+def valid_lines(file: Dict[str, Union[str, int]], matcher: Matcher, all_words: bool) -> Generator[Tuple[int, List[int], str], None, None]:
+    """
+    Pesquisa dada(s) palavra(s) num ficheiro e filtra as linhas que contam para o resultado.
+    :param file: Dicionário com o path, o start e o end de um ficheiro
+    :param matcher: Motor de pesquisa (criado por compile_matcher) com as palavras a pesquisar/contar.
+    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
+                      contabilizar linhas com todas as palavras dadas.
+    :return: Gerador de tuplos com o índice da linha, as ocorrências de cada palavra nessa linha e a linha original,
+             por ordem e sem repetir linhas.
+    """
+    words = matcher['words']
 
-        # Iterador em que o valor de cada palavra é boolean (se foi encontrada ou não na linha).
-        diff_zero = [line_word_occurrences[word] != 0 for word in line_word_occurrences]
-        it = iter(diff_zero)
+    # Pesquisa em blocos quando há uma expressão regular combinada, e linha a linha caso contrário
+    if matcher['regex'] is not None:
+        matches = search_blocks(file, matcher)
+    else:
+        matches = search_lines(file, matcher)
 
-        # Como é iterador, o any consome até ao primeiro True que encontra.
-        # Logo, se consumimos o primeiro True e negamos o próximo, sabemos que só existe um.
-        is_valid = any(it) and not any(it)
+    # Para cada linha i com pelo menos uma palavra
+    for i, line_word_occurrences, line in matches:
+        # Quantidade de palavras diferentes encontradas na linha
+        found = len(words) - line_word_occurrences.count(0)
 
-        # Sem o parâmetro -a, só pode haver uma palavra por linha, ou seja o valor de is_valid
+        # Sem o parâmetro -a, só pode haver uma palavra por linha
         # Mas com o parâmetro -a, ou all_words no contexto da função, ativo, pode ser apenas uma palavra na linha ou todas as palavras nessa linha
-        if all_words and not is_valid:
-            # Assim, reescreve-se o valor de is_valid para que o seu significado seja se todas as palavras estão presentes na linha
-            is_valid = all(diff_zero)
+        is_valid = found == 1 or (all_words and found == len(words))
 
         # Após a validação do argumento -a, só se conta estas ocorrências se a validação tiver resultado positivo
         if is_valid:
-            # Agora adiciona-se ao dicionário occurrences os resultados da linha atual, para cada palavra
-            for word in line_word_occurrences:
-                # só se insere se houver ocorrência(s) da palavra na linha
-                if line_word_occurrences[word] != 0:
-                    # i representa o índice da linha
-                    occurrences[word][i] = line_word_occurrences[word]
+            yield i, line_word_occurrences, line
+
+def count_file(file: Dict[str, Union[str, int]], matcher: Matcher, all_words: bool, count: bool, out: TextIO = None, base: int = None, max_count: int = 0) -> List[int]:
+    """
+    Pesquisa e conta ocorrências de dada(s) palavra(s) num ficheiro, apenas com contadores.
+    As linhas não são guardadas: como cada linha válida é gerada uma única vez, a quantidade
+    de linhas (também com -a -l) é apenas mais um contador.
+
+    :param file: Dicionário com o path, o start e o end de um ficheiro
+    :param matcher: Motor de pesquisa (criado por compile_matcher) com as palavras a pesquisar/contar.
+    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
+                      contabilizar linhas com todas as palavras dadas.
+    :param count: Bool cujo True representa se é contada a quantidade de ocorrências
+                  e cujo False a quantidade de linhas.
+    :param out?: Ficheiro onde são escritas as linhas encontradas (ver write_lines)
+    :param base?: Quantidade de linhas do ficheiro antes da parcela (ver write_lines)
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas (ver limit_lines). 0 se não houver limite.
+    :return: Ocorrências mapeadas: a quantidade de ocorrências (-c) ou de linhas (-l) de cada palavra, ou apenas
+             a quantidade de linhas com todas as palavras (-a -l). Na opção --top, não há palavras dadas e a lista é vazia.
+             No fim, file['timings'] tem o tempo de cada fase (ver PHASES), exceto o registo dos resultados.
+    """
+    inicio = time()
+    file['timings'] = dict.fromkeys(PHASES, 0.0)
+
+    if matcher['vocabulary']:
+        count_vocabulary(file)
+        ret = []
+    else:
+        ret = count_matches(file, matcher, all_words, count, out, base, max_count)
+
+    # A pesquisa é o tempo que não foi gasto nas outras fases
+    timings = file['timings']
+    timings['match'] = time() - inicio - timings['read'] - timings['decode'] - timings['fold']
+    return ret
+
+def count_matches(file: Dict[str, Union[str, int]], matcher: Matcher, all_words: bool, count: bool, out: TextIO = None, base: int = None, max_count: int = 0) -> List[int]:
+    """
+    Pesquisa e conta ocorrências de dada(s) palavra(s) num ficheiro (ver count_file).
+    :return: Ocorrências mapeadas (ver count_file)
+    """
+    lines = valid_lines(file, matcher, all_words)
+    if max_count:
+        # Linhas escritas sem formatar (base None) são juntas pelo pai, pela ordem das parcelas
+        lines = limit_lines(lines, file, count, out is not None and base is None)
+    if out is not None:
+        lines = write_lines(lines, out, file['path'] if base is not None else None, base)
+
+    # Argumento -a -l: linhas que respeitam a pesquisa
+    if all_words and not count:
+        return [ sum(1 for _ in lines) ]
+
+    ret = [0] * len(matcher['words'])
+    for _, line_word_occurrences, _ in lines:
+        for i, qtty in enumerate(line_word_occurrences):
+            # Argumento -c soma as ocorrências, -l conta as linhas onde a palavra ocorre
+            if qtty != 0:
+                ret[i] += qtty if count else 1
+    return ret
+
+def count_vocabulary(file: Dict[str, Union[str, int]]) -> None:
+    """
+    Conta todas as palavras de um ficheiro (sem diacríticos, ver WORD_REGEX) na tabela vocabulary do processo.
+    :param file: Dicionário com o path, o start e o end de um ficheiro. No fim, file['lines'] tem a quantidade de linhas lidas.
+    """
+    timings = file['timings']
+    lines = 0
+    block = b''
+    for block in timed(read_blocks(file), timings, 'read'):
+        inicio = time()
+        text = str(block, 'utf-8', 'replace')
+        decoded = time()
+        text = fold_accents(text)
+        timings['decode'] += decoded - inicio
+        timings['fold'] += time() - decoded
+
+        vocabulary.update(WORD_REGEX.findall(text))
+        # A remoção de diacríticos não altera as quebras de linha
+        lines += text.count('\n')
+
+        if len(vocabulary) > VOCABULARY_MAX_WORDS:
+            spill_vocabulary()
+
+    # A última linha do ficheiro pode não acabar com quebra de linha
+    file['lines'] = lines + (1 if block and block[-1:] != b'\n' else 0)
+
+def spill_vocabulary() -> None:
+    """
+    Escreve a tabela vocabulary do processo num ficheiro de spill_dir, ordenada pelas palavras
+    (uma linha palavra\tquantidade por palavra), e esvazia-a.
+    """
+    if not vocabulary:
+        return
 
-    return occurrences
+    from tempfile import mkstemp
+
+    fd, path = mkstemp(prefix='vocabulary-', dir=spill_dir)
+    with open(fd, 'w', encoding='utf-8', newline='\n') as f:
+        f.writelines(f'{word}\t{qtty}\n' for word, qtty in sorted(vocabulary.items(), key=itemgetter(0)))
+    vocabulary.clear()
+
+def read_vocabulary(path: str) -> Generator[Tuple[str, int], None, None]:
+    """
+    Lê uma tabela de palavras escrita por spill_vocabulary.
+    :param path: Caminho do ficheiro
+    :return: Gerador de tuplos com a palavra e a quantidade, ordenados pelas palavras
+    """
+    with open(path, encoding='utf-8', newline='\n') as f:
+        for line in f:
+            word, qtty = line.rstrip('\n').split('\t')
+            yield word, int(qtty)
+
+def top_words(k: int) -> Tuple[List[Tuple[str, int]], int, int]:
+    """
+    Junta as tabelas de palavras de todos os processos (escritas em spill_dir) e obtém as K mais frequentes.
+    As tabelas estão ordenadas pelas palavras, logo são juntas numa só passagem, sem serem carregadas para a memória:
+    apenas as K palavras mais frequentes até ao momento são guardadas.
+    :param k: Quantidade de palavras
+    :return: Tuplo com a lista das K palavras mais frequentes (e as suas quantidades, por ordem decrescente; em caso de
+             empate, por ordem alfabética), a quantidade de palavras diferentes e a quantidade total de palavras.
+    """
+    distinct, total = 0, 0
+
+    def totals() -> Generator[Tuple[str, int], None, None]:
+        nonlocal distinct, total
+        tables = [ read_vocabulary(join(spill_dir, name)) for name in sorted(listdir(spill_dir)) ]
+        # As ocorrências da mesma palavra nas várias tabelas ficam seguidas
+        word, qtty = None, 0
+        for next_word, next_qtty in merge(*tables, key=itemgetter(0)):
+            total += next_qtty
+            if next_word == word:
+                qtty += next_qtty
+                continue
+
+            if word is not None:
+                distinct += 1
+                yield word, qtty
+            word, qtty = next_word, next_qtty
+
+        if word is not None:
+            distinct += 1
+            yield word, qtty
+
+    return nlargest(k, totals(), key=itemgetter(1)), distinct, total
+
+def print_top(top: List[Tuple[str, int]], distinct: int, total: int) -> None:
+    """
+    Imprime as palavras mais frequentes (opção --top) para o stdout.
+    :param top: Lista de tuplos com a palavra e a quantidade (ver top_words)
+    :param distinct: Quantidade de palavras diferentes
+    :param total: Quantidade total de palavras
+    """
+    print(f'{Fore.LIGHTRED_EX}As {len(top)} palavras mais frequentes{" até ao momento" if stop else ""}:{Style.RESET_ALL}')
+    for rank, (word, qtty) in enumerate(top, 1):
+        print(f'\t{rank}. A palavra {Fore.CYAN}{word}{Fore.RESET} ocorre {Fore.GREEN}{qtty}{Fore.RESET} vezes.')
+    print(f'\t{Fore.GREEN}{distinct}{Fore.RESET} palavras diferentes, {Fore.GREEN}{total}{Fore.RESET} no total.')
+
+def limit_lines(lines: Generator[Tuple[int, List[int], str], None, None], file: Dict[str, Union[str, int]], count: bool, ordered: bool = False) -> Generator[Tuple[int, List[int], str], None, None]:
+    """
+    Deixa passar linhas encontradas enquanto houver matches_left, partilhado por todos os processos, e
+    termina a pesquisa da parcela (a meio) assim que o limite é atingido, por este ou por outro processo.
+    Com -c, a última linha aceite passa com todas as suas ocorrências, mesmo que ultrapassem as que faltavam.
+    Quando a parcela não é pesquisada até ao fim, file['partial'] fica True (e file['lines'] fica incompleto).
+    :param lines: Gerador de linhas válidas (ver valid_lines)
+    :param file: Dicionário com o path, o start e o end de uma parcela
+    :param count: Bool cujo True representa se o limite é de ocorrências e cujo False de linhas.
+    :param ordered?: Bool cujo True representa se as linhas são juntas pelo pai, pela ordem das parcelas (ver merge_lines).
+                     Nesse caso, é o pai que consome matches_left e a parcela termina quando já encontrou tantas
+                     linhas quantas as que ainda faltam (as parcelas anteriores só podem diminuir esse valor).
+    :return: Gerador com as linhas dentro do limite
+    """
+    found = 0
+    for i, line_word_occurrences, line in lines:
+        amount = sum(line_word_occurrences) if count else 1
+        if ordered:
+            if found >= matches_left.value:
+                file['partial'] = True
+                return
+
+            found += amount
+            yield i, line_word_occurrences, line
+            continue
+
+        with matches_left.get_lock():
+            left = matches_left.value
+            if left > 0:
+                matches_left.value = left - amount
+
+        if left <= 0:
+            file['partial'] = True
+            return
+
+        yield i, line_word_occurrences, line
+
+        # Esta foi a última linha dentro do limite
+        if left <= amount:
+            file['partial'] = True
+            return
+
+def limit_reached(max_count: int) -> bool:
+    """
+    Verifica se o limite global de linhas (ou ocorrências) encontradas da opção -m já foi atingido.
+    :param max_count: Limite dado com a opção -m (0 se não houver limite)
+    :return: Bool cujo True representa se o limite foi atingido
+    """
+    return max_count > 0 and matches_left.value <= 0
+
+def format_line(path: str, number: int, line: str) -> str:
+    """
+    Formata uma linha encontrada, à semelhança do grep.
+    :param path: Caminho do ficheiro
+    :param number: Número da linha no ficheiro (a começar em 1)
+    :param line: Linha original
+    :return: String com o caminho, o número e a linha
+    """
+    return f'{Fore.LIGHTMAGENTA_EX}{path}{Fore.RESET}:{Fore.GREEN}{number}{Fore.RESET}:{line}\n'
+
+def write_lines(lines: Generator[Tuple[int, List[int], str], None, None], out: TextIO, path: str = None, base: int = None) -> Generator[Tuple[int, List[int], str], None, None]:
+    """
+    Escreve as linhas encontradas à medida que passam pelo gerador (sem as guardar em memória).
+    :param lines: Gerador de linhas válidas (ver valid_lines)
+    :param out: Ficheiro onde escrever
+    :param path?: Caminho do ficheiro. Quando especificado, as linhas são escritas já formatadas (ver format_line).
+                  Caso contrário, cada linha é escrita como índice (na parcela), ocorrências e linha original,
+                  separados por tabulações (ver print_spill).
+    :param base?: Quantidade de linhas do ficheiro antes da parcela
+    :return: Gerador com as mesmas linhas
+    """
+    for i, line_word_occurrences, line in lines:
+        if path is None:
+            out.write(f'{i}\t{sum(line_word_occurrences)}\t{line}\n')
+        else:
+            out.write(format_line(path, base + i + 1, line))
+        yield i, line_word_occurrences, line
+
+def print_spill(file: Dict[str, Union[str, int]], base: int, count: bool = False, max_count: int = 0) -> None:
+    """
+    Escreve para o stdout as linhas encontradas numa parcela, guardadas em spill_dir por um filho, e apaga-as.
+    :param file: Dicionário com o path e o seq de uma parcela
+    :param base: Quantidade de linhas do ficheiro antes da parcela
+    :param count?: Bool cujo True representa se o limite é de ocorrências e cujo False de linhas.
+    :param max_count?: Limite global da opção -m (0 se não houver limite). Cada linha escrita consome matches_left
+                       e a escrita termina quando o limite é atingido (ver limit_lines).
+    """
+    path = join(spill_dir, str(file['seq']))
+    if not exists(path):
+        return
+
+    # Apenas '\n' separa os registos (a linha original pode ter '\r')
+    with open(path, 'r', encoding='utf-8', newline='\n') as spill:
+        for record in spill:
+            if limit_reached(max_count):
+                break
+
+            i, occurrences, line = record[:-1].split('\t', 2)
+            sys.stdout.write(format_line(file['path'], base + int(i) + 1, line))
+            if max_count:
+                with matches_left.get_lock():
+                    matches_left.value -= int(occurrences) if count else 1
+    unlink(path)
+
+def unlink_spill(file: Dict[str, Union[str, int]]) -> None:
+    """
+    Apaga as linhas encontradas numa parcela, guardadas em spill_dir, sem as escrever.
+    :param file: Dicionário com o seq de uma parcela
+    """
+    path = join(spill_dir, str(file['seq']))
+    if exists(path):
+        unlink(path)
+
+def merge_lines(ordered: List[Dict[str, Union[str, int]]], processes: List['Process'], count: bool = False, max_count: int = 0) -> None:
+    """
+    Escreve para o stdout as linhas encontradas pelos filhos, pela ordem dos ficheiros e das parcelas
+    (independentemente da ordem em que os filhos as terminam), até todos os filhos terminarem.
+    O número de cada linha é o seu índice na parcela mais as linhas das parcelas anteriores do mesmo ficheiro.
+    Com a opção -m, o limite é aplicado pela mesma ordem (ver print_spill): quando é atingido, os filhos deixam
+    de pesquisar e as parcelas que ficaram por pesquisar nunca chegam, mas já não seriam escritas.
+    :param ordered: Parcelas de ficheiro (ver chunks), pela ordem de seq. Com a opção -r, a lista vai crescendo
+                    (ver discover), mas uma parcela é sempre acrescentada antes de ser dada a um filho.
+    :param processes: Processos filhos
+    :param count?: Bool cujo True representa se o limite é de ocorrências e cujo False de linhas.
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas. 0 se não houver limite.
+    """
+    done = {} # Parcelas terminadas e ainda não escritas (seq -> quantidade de linhas, None se ficou a meio)
+    following = 0 # seq da próxima parcela a escrever
+    base = 0
+    finished = 0
+    closed = False # O stdout foi fechado pelo leitor (ver broken_pipe): as linhas deixam de ser escritas
+    for message in messages(lines_done, processes):
+        if message is None:
+            finished += 1
+            if finished == len(processes):
+                break
+            continue
+
+        seq, lines = message
+        done[seq] = lines
+        while following in done:
+            file = ordered[following]
+            if following > 0 and ordered[following - 1]['file_id'] != file['file_id']:
+                base = 0
+            # Com a opção --index, o número da primeira linha da parcela já é conhecido (ver align_chunks)
+            if file.get('line') is not None:
+                base = file['line']
+
+            # Depois de uma parcela que ficou a meio (opção -m), sem a opção --index, o número das linhas seguintes do mesmo ficheiro não é conhecido
+            if base is not None and not limit_reached(max_count) and not closed:
+                try:
+                    print_spill(file, base, count, max_count)
+                except BrokenPipeError:
+                    broken_pipe(processes)
+                    closed = True
+                    unlink_spill(file)
+                lines = done.pop(following)
+                base = base + lines if lines is not None else None
+            else:
+                done.pop(following)
+                unlink_spill(file)
+            following += 1
+
+    # Após um SIGINT (ou atingido o limite da opção -m), as parcelas depois da primeira em falta já não são escritas
+
+def broken_pipe(processes: List['Process'] = ()) -> None:
+    """
+    O leitor do stdout terminou (e.g. pgrepwc -n ... | head): o stdout passa a ser o /dev/null, para que as escritas
+    seguintes não falhem, e a pesquisa termina como após um SIGINT, também nos filhos.
+    :param processes?: Processos filhos
+    """
+    global stop
+
+    stop = True
+    with open(devnull, 'w') as null:
+        dup2(null.fileno(), sys.stdout.fileno())
+
+    for process in processes:
+        if process.exitcode is None:
+            kill(process.pid, SIGINT)
+
+def print_skipped() -> None:
+    """
+    Imprime a quantidade de ficheiros binários ignorados (se houver).
+    """
+    if binary_skipped:
+        print(f'{Fore.LIGHTBLACK_EX}{len(binary_skipped)} ficheiro(s) binário(s) ignorado(s) ({sum(binary_skipped.values())} bytes).{Style.RESET_ALL}')
 
 def print_results(words: List[str], all_words: bool, count: bool, val: List[str] = None) -> None:
     """
@@ -343,102 +1358,242 @@ def print_results(words: List[str], all_words: bool, count: bool, val: List[str]
                   e cujo False a quantidade de linhas.
     :param val?: Lista de Strings com valores a escrever. Quando especificado, sobrepõe-se aos valores totais
     """
+    if val is None:
+        val = sum_totals(len(words))
+
     if count:
         for i, word in enumerate(words):
             # Somar todas as ocorrências de todas as
-            print(f'\tA palavra {Fore.CYAN}{word}{Fore.RESET} ocorre {Fore.GREEN}{val[i] if val else total[i]}{Fore.RESET} vezes.')
+            print(f'\tA palavra {Fore.CYAN}{word}{Fore.RESET} ocorre {Fore.GREEN}{val[i]}{Fore.RESET} vezes.')
     else:
         # Argumento -l
         if all_words:
             # numero de linhas devolvidas da pesquisa
-            print(f'\t{Fore.GREEN}{val[0] if val else total[0]}{Fore.RESET} linhas respeitam a pesquisa.')
+            print(f'\t{Fore.GREEN}{val[0]}{Fore.RESET} linhas respeitam a pesquisa.')
         else:
             # numero linhas devolvida é por palavra
             for i, word in enumerate(words):
                 print(
-                    f'\tA palavra {Fore.CYAN}{word}{Fore.RESET} ocorre em {Fore.GREEN}{val[i] if val else total[i]}{Fore.RESET} linhas.')
+                    f'\tA palavra {Fore.CYAN}{word}{Fore.RESET} ocorre em {Fore.GREEN}{val[i]}{Fore.RESET} linhas.')
+
+def sum_progress(words: int) -> List[int]:
+    """
+    Soma as linhas da tabela de progresso de todos os processos.
+    :param words: Quantidade de palavras
+    :return: Lista com o total de cada coluna (ver progress)
+    """
+    width = PROGRESS_WORDS + words
+    rows = len(progress) // width
+    return [ sum(progress[row * width + i] for row in range(rows)) for i in range(width) ]
 
-def commit_results(word_occurrences: Dict[str, Dict[int, int]], all_words: bool, count: bool) -> List[int]:
+def sum_totals(words: int) -> List[int]:
     """
-    Mapeia as ocorrências dependendo dos argumentos do utilizador e incrementa os resultados globais.
+    Soma os contadores das palavras de todos os processos.
+    :param words: Quantidade de palavras
+    :return: Lista com o total de cada palavra
+    """
+    return sum_progress(words)[PROGRESS_WORDS:]
 
-    :param word_occurrences: Dicionário com as ocorrências das palavras em cada linha.
-    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
-                      com todas as palavras dadas.
-    :param count: Bool cujo True representa se é impressa a quantidade de ocorrências
-                  e cujo False a quantidade de linhas.
-    :return: Ocorrências mapeadas
+def commit_results(vals: List[int], words: int, row: int) -> None:
     """
-    ret = []
-    # Argumento -c
-    if count:
-        for i, word in enumerate(word_occurrences):
-            # Somar todas as ocorrências de todas as
-            val = sum(word_occurrences[word][k] for k in word_occurrences[word])
-            ret.append(val)
-            mutex.acquire()
-            total[i] += val
-            mutex.release()
+    Incrementa os resultados globais na linha do processo (sem Lock, visto que mais nenhum processo escreve nessa linha).
+
+    :param vals: Ocorrências mapeadas (ver count_file)
+    :param words: Quantidade de palavras
+    :param row: Linha do processo na tabela de progresso
+    """
+    offset = row * (PROGRESS_WORDS + words) + PROGRESS_WORDS
+    for i, val in enumerate(vals):
+        progress[offset + i] += val
+
+def commit_progress(file: Dict[str, Union[str, int]], words: int, row: int) -> None:
+    """
+    Regista na linha do processo da tabela de progresso uma parcela de ficheiro processada.
+    :param file: Dicionário com o path, o file_id, o start, o end e as lines de um ficheiro
+    :param words: Quantidade de palavras
+    :param row: Linha do processo na tabela de progresso
+    """
+    offset = row * (PROGRESS_WORDS + words)
+    progress[offset + PROGRESS_BYTES] += file['end'] - file['start']
+    progress[offset + PROGRESS_LINES] += file['lines']
+
+    # Na opção -r, a quantidade de ficheiros não é conhecida de antemão, e um ficheiro conta como
+    # terminado quando a sua última parcela termina
+    if files_left is None:
+        finished = file.get('last', False)
     else:
-        # Argumento -l
-        if all_words:
-            # numero de linhas devolvidas da pesquisa
-            val = len(set(key for word in word_occurrences for key in word_occurrences[word].keys()))
-            ret.append(val)
-            mutex.acquire()
-            total[0] += val
-            mutex.release()
-        else:
-            # numero linhas devolvida é por palavra
-            for i, word in enumerate(word_occurrences):
-                val = len(word_occurrences[word])
-                ret.append(val)
-                mutex.acquire()
-                total[i] += val
-                mutex.release()
-    return ret
+        # Sem processos filhos, o array é local e não precisa de Lock
+        with files_left.get_lock() if not isinstance(files_left, array) else nullcontext():
+            files_left[file['file_id']] -= 1
+            finished = files_left[file['file_id']] == 0
+
+    if finished:
+        progress[offset + PROGRESS_FILES] += 1
 
-def process_files(files: List[Dict[str, Union[str, int]]], words: List[Tuple[str, Pattern]], all_words: bool, count: bool) -> None:
+def process_files(files: List[Dict[str, Union[str, int]]], row: int, matcher: Matcher, all_words: bool, count: bool, print_lines: bool = False, max_count: int = 0) -> List[Dict]:
     """
     Processa e imprime resultados da pesquisa/contagem de dadas palavras em dados ficheiros.
     :param files: Lista de Strings com o caminho dos ficheiros.
-    :param words: Lista de tuplos com pares String palavra e a sua Pattern
-                  expressão regular a pesquisar/contar.
+    :param row: Linha do processo na tabela de progresso
+    :param matcher: Motor de pesquisa (criado por compile_matcher) com as palavras a pesquisar/contar.
     :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
                       com todas as palavras dadas.
     :param count: Bool cujo True representa se é impressa a quantidade de ocorrências
                   e cujo False a quantidade de linhas.
+    :param print_lines?: Bool cujo True representa se são impressas as linhas encontradas, em vez dos resultados.
+                         Os filhos escrevem-nas em spill_dir; sem filhos, são escritas diretamente para o stdout.
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas. 0 se não houver limite.
+    :return: Lista dos dados do processamento de cada ficheiro (ver dic_files_done)
     """
+    done = []
+    bases = {} # Linhas já lidas de cada ficheiro (apenas sem filhos, em que as parcelas são processadas por ordem)
     for file in files:
         inicio = time()
 
         # Pesquisar e contar as palavras
-        word_occurrences = search_file(file, words, all_words)
-        # Processar e guardar os resultados no Array total
-        vals = commit_results(word_occurrences, all_words, count)
-
-        # Imprimir resultados
-        mutex.acquire()
-        print(f'{Fore.LIGHTMAGENTA_EX}Ficheiro {file["path"]}:{Style.RESET_ALL}')
-        print_results(word_occurrences.keys(), all_words, count, vals)
-        mutex.release()
-
-        dados = {
+        failed = False
+        try:
+            if not print_lines:
+                vals = count_file(file, matcher, all_words, count, max_count=max_count)
+            elif spill_dir is None:
+                base = file['line'] if file.get('line') is not None else bases.get(file['file_id'], 0)
+                vals = count_file(file, matcher, all_words, count, sys.stdout, base, max_count)
+                bases[file['file_id']] = base + file['lines']
+            else:
+                with open(join(spill_dir, str(file['seq'])), 'w', encoding='utf-8', newline='\n') as spill:
+                    vals = count_file(file, matcher, all_words, count, spill, max_count=max_count)
+        except BrokenPipeError:
+            # O stdout foi fechado (ver broken_pipe), não o ficheiro
+            raise
+        except OSError as err:
+            # Ficheiro que deixou de existir ou não pode ser lido: a parcela fica por pesquisar (não é terminada no histórico)
+            with mutex:
+                print(f'{Fore.LIGHTRED_EX}Ficheiro {file["path"]}: {err}{Fore.RESET}')
+            vals = [0] * (1 if all_words and not count else len(matcher['words']))
+            file['partial'] = True
+            file.setdefault('timings', dict.fromkeys(PHASES, 0.0))
+            failed = True
+
+        if print_lines and spill_dir is not None:
+            sent = time()
+            lines_done.put((file['seq'], None if file.get('partial') else file['lines']))
+            process_timings['ipc'] += time() - sent
+
+        # Guardar os resultados na tabela de progresso
+        searched = time()
+        commit_results(vals, len(matcher['words']), row)
+        commit_progress(file, len(matcher['words']), row)
+
+        # Imprimir resultados (na opção --top, apenas no fim, com as tabelas de todos os processos)
+        if not print_lines and not matcher['vocabulary'] and not failed:
+            # O Lock é libertado mesmo que a escrita falhe (e.g. BrokenPipeError), para não bloquear os outros processos
+            with mutex:
+                print(f'{Fore.LIGHTMAGENTA_EX}Ficheiro {file["path"]}:{Style.RESET_ALL}')
+                print_results(matcher['words'], all_words, count, vals)
+        file['timings']['commit'] = time() - searched
+
+        done.append({
             'pid': getpid(),
             'file': file,
             'duration': time() - inicio,
             'occurrences': vals
-        }
+        })
 
-        if current_process().name == 'MainProcess':
-            put_files_done(dados)
-        else:
-            pipe_filho.send(dados)
+        if stop or limit_reached(max_count):
+            break
+
+    return done
 
-        if stop:
+def process_queue(queue: 'Queue', row: int, matcher: Matcher, all_words: bool, count: bool, print_lines: bool = False, max_count: int = 0) -> List[Dict]:
+    """
+    Retira parcelas da fila partilhada e processa-as, uma de cada vez, até encontrar None.
+    :param queue: Fila de parcelas (listas de ficheiros, ver chunks).
+    :param row: Linha do processo na tabela de progresso
+    :param matcher: Motor de pesquisa (criado por compile_matcher) com as palavras a pesquisar/contar.
+    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
+                      com todas as palavras dadas.
+    :param count: Bool cujo True representa se é impressa a quantidade de ocorrências
+                  e cujo False a quantidade de linhas.
+    :param print_lines?: Bool cujo True representa se são impressas as linhas encontradas, em vez dos resultados.
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas. 0 se não houver limite.
+    :return: Lista dos dados do processamento de cada ficheiro (ver dic_files_done)
+    """
+    done = []
+    while not stop and not limit_reached(max_count):
+        inicio = time()
+        files = queue.get()
+        process_timings['wait'] += time() - inicio
+        if files is None:
             break
 
-    children_active.value -= 1
+        done += process_files(files, row, matcher, all_words, count, print_lines, max_count)
+
+    return done
+
+def child(work: Union[List[Dict[str, Union[str, int]]], 'Queue'], row: int, matcher: Matcher, all_words: bool, count: bool, print_lines: bool = False, max_count: int = 0, profile_dir: str = None) -> None:
+    """
+    Processo filho: processa a sua parcela (ou as parcelas da fila partilhada) e, no fim, envia ao pai
+    os dados de todos os ficheiros processados e os tempos do processo (ver dic_process_timings).
+    :param work: Parcela atribuída ao processo (escalonamento estático) ou fila de parcelas (escalonamento dinâmico).
+    :param row: Linha do processo na tabela de progresso
+    :param matcher: Motor de pesquisa (criado por compile_matcher) com as palavras a pesquisar/contar.
+    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
+                      com todas as palavras dadas.
+    :param count: Bool cujo True representa se é impressa a quantidade de ocorrências
+                  e cujo False a quantidade de linhas.
+    :param print_lines?: Bool cujo True representa se são impressas as linhas encontradas, em vez dos resultados.
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas. 0 se não houver limite.
+    :param profile_dir?: Diretoria onde é escrito o perfil (cProfile) do processo (ver start_profile).
+    """
+    done = []
+    # Mesmo que a pesquisa falhe, o pai recebe os dados e o fim das linhas do processo (ver messages)
+    try:
+        profiler = start_profile(profile_dir)
+        if isinstance(work, list):
+            done = process_files(work, row, matcher, all_words, count, print_lines, max_count)
+        else:
+            done = process_queue(work, row, matcher, all_words, count, print_lines, max_count)
+        stop_profile(profiler, profile_dir)
+
+        # Opção --top: o pai junta as tabelas de palavras de todos os processos a partir de spill_dir
+        if matcher['vocabulary']:
+            spill_vocabulary()
+    finally:
+        with children_active.get_lock():
+            children_active.value -= 1
+
+        sent = time()
+        if print_lines:
+            lines_done.put(None)
+        process_timings['ipc'] += time() - sent
+        results.put((done, process_timings))
+
+def start_profile(profile_dir: str = None) -> Union['Profile', None]:
+    """
+    Começa a medir o perfil (cProfile) do processo, se tiver sido pedido com a opção --profile.
+    :param profile_dir?: Diretoria onde o perfil vai ser escrito (None se não tiver sido pedido)
+    :return: Profile ativo, ou None
+    """
+    if not profile_dir:
+        return None
+
+    from cProfile import Profile
+
+    profiler = Profile()
+    profiler.enable()
+    return profiler
+
+def stop_profile(profiler: Union['Profile', None], profile_dir: str = None) -> None:
+    """
+    Termina o perfil do processo e escreve-o em profile_dir/<pid>.prof (para ler com pstats ou snakeviz).
+    :param profiler: Profile devolvido por start_profile
+    :param profile_dir?: Diretoria onde escrever o perfil
+    """
+    if profiler is None:
+        return
+
+    profiler.disable()
+    profiler.dump_stats(join(profile_dir, f'{getpid()}.prof'))
 
 def sigint(_sig, _null) -> None:
     """
@@ -456,27 +1611,21 @@ def interval(interval: int, words: List[str], all_words: bool) -> None:
     :param interval: Intervalo em segundos
     """
 
-    qtty_total = len(dic_files_total)
     while children_active.value > 0:
-        dic_done = {k: 0 for k in dic_files_total }
-        occurrences = [0, 0, 0]
-        for p in dic_files_done:
-            for f in dic_files_done[p]:
-                dic_done[f['file']['path']] += 1
-                occurrences = [a + b for a, b in zip(occurrences, f['occurrences'])]
+        # Com a opção -r, os ficheiros vão sendo encontrados durante a pesquisa
+        qtty_total = len(dic_files_total)
+        # Apenas uma linha por processo a somar
+        sums = sum_progress(len(words))
+        occurrences = sums[PROGRESS_WORDS:]
 
-
-        remaining = set()
-        for k in dic_done:
-            if dic_files_total[k] != dic_done[k]:
-                remaining.add(k)
-
-        qtty_remaining = len(remaining)
+        qtty_remaining = qtty_total - sums[PROGRESS_FILES]
         taken = to_micro(time()-inicio_execucao)
         len_taken = len(str(taken)) + 2
 
         res = [ f'{Fore.RESET}Ficheiros completamente processados: {Fore.LIGHTBLACK_EX}..................{"." * (len_taken - len(str(qtty_total - qtty_remaining)))} {Fore.LIGHTGREEN_EX}{qtty_total - qtty_remaining}',
                 f'{Fore.RESET}Ficheiros em processamento: {Fore.LIGHTBLACK_EX}...........................{"." * (len_taken - len(str(qtty_remaining)))} {Fore.LIGHTGREEN_EX}{qtty_remaining}',
+                f'{Fore.RESET}Linhas processadas: {Fore.LIGHTBLACK_EX}...................................{"." * (len_taken - len(str(sums[PROGRESS_LINES])))} {Fore.LIGHTGREEN_EX}{sums[PROGRESS_LINES]}',
+                f'{Fore.RESET}Bytes processados: {Fore.LIGHTBLACK_EX}....................................{"." * (len_taken - len(str(sums[PROGRESS_BYTES])))} {Fore.LIGHTGREEN_EX}{sums[PROGRESS_BYTES]}',
                 f'{Fore.RESET}Tempo decorrido desde o início da execução do programa: {Fore.LIGHTGREEN_EX}{taken}µs' ]
 
         for i, word in enumerate(words):
@@ -495,20 +1644,375 @@ def put_files_done(dados) -> None:
         dic_files_done[dados['pid']] = []
     dic_files_done[dados['pid']].append(dados)
 
-def get_children_data() -> None:
+def follow(files: List[Dict[str, Union[str, int]]], matcher: Matcher, all_words: bool, count: bool, print_lines: bool = False, max_count: int = 0) -> None:
+    """
+    Modo --follow: a cada FOLLOW_INTERVAL segundos, pesquisa apenas as linhas acrescentadas a cada ficheiro desde a última
+    pesquisa (o intervalo [start, end) de uma parcela, como em read_file), até ao SIGINT. Os resultados somam-se à tabela
+    de progresso (linha 0) e ao dic_files_done. Se o inode mudar (rotação) ou o ficheiro diminuir (truncagem),
+    o ficheiro volta a ser pesquisado desde o início.
+    :param files: Estado de cada ficheiro: Dicionário com o path, o file_id, o inode, o offset (bytes já pesquisados)
+                  e as lines (linhas já pesquisadas)
+    :param matcher: Motor de pesquisa (criado por compile_matcher) com as palavras a pesquisar/contar.
+    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
+                      com todas as palavras dadas.
+    :param count: Bool cujo True representa se é impressa a quantidade de ocorrências
+                  e cujo False a quantidade de linhas.
+    :param print_lines?: Bool cujo True representa se são impressas as linhas encontradas, em vez dos resultados.
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas. 0 se não houver limite.
+    """
+    print(f'{Fore.LIGHTBLACK_EX}Following...{Style.RESET_ALL}')
+    while not stop and not limit_reached(max_count):
+        sleep(FOLLOW_INTERVAL)
+
+        for state in files:
+            try:
+                st = stat(state['path'])
+            except OSError:
+                # O ficheiro pode ainda não existir, ou estar a ser rodado
+                continue
+
+            if st.st_ino != state['inode'] or st.st_size < state['offset']:
+                if state['inode'] is not None:
+                    print(f'{Fore.LIGHTBLACK_EX}Ficheiro {state["path"]} foi rodado ou truncado.{Style.RESET_ALL}')
+                state.update(inode=st.st_ino, offset=0, lines=0)
+
+            if st.st_size <= state['offset']:
+                continue
+
+            # Apenas linhas completas: a última linha pode ainda estar a ser escrita
+            with open(state['path'], 'rb') as f, mmap(f.fileno(), 0, access=ACCESS_READ) as m:
+                end = m.rfind(b'\n', state['offset'], st.st_size) + 1
+            if end <= state['offset']:
+                continue
+
+            inicio = time()
+            file = { 'path': state['path'],
+                     'file_id': state['file_id'],
+                     'seq': 0,
+                     'start': state['offset'],
+                     'end': end,
+                     'lines': 0 }
+            vals = count_file(file, matcher, all_words, count, sys.stdout if print_lines else None, state['lines'] if print_lines else None, max_count)
+            commit_results(vals, len(matcher['words']), 0)
+            progress[PROGRESS_BYTES] += end - file['start']
+            progress[PROGRESS_LINES] += file['lines']
+
+            put_files_done({
+                'pid': getpid(),
+                'file': file,
+                'duration': time() - inicio,
+                'occurrences': vals
+            })
+
+            if not print_lines and any(vals):
+                print(f'{Fore.LIGHTMAGENTA_EX}Ficheiro {file["path"]}:{Style.RESET_ALL}')
+                print_results(matcher['words'], all_words, count, vals)
+
+            state.update(offset=end, lines=state['lines'] + file['lines'])
+
+def messages(queue: 'Queue', processes: List['Process']) -> Generator:
     """
-    Mensagens que o processo pai recebe e sobre o ficheiro processado por um filho
+    Gera as mensagens enviadas pelos filhos numa fila, até todos os filhos terem terminado e a fila estar vazia.
+    Um filho que morre sem enviar as suas mensagens (e.g. terminado por um sinal) não deixa o pai à espera para sempre.
+    :param queue: Fila partilhada (results ou lines_done)
+    :param processes: Processos filhos
+    :return: Gerador das mensagens
     """
-    while children_active.value > 0:
-        dados = pipe_pai.recv()
-        put_files_done(dados)
+    while True:
+        try:
+            yield queue.get(timeout=CHILD_POLL)
+        except Empty:
+            if all(process.exitcode is not None for process in processes) and queue.empty():
+                return
 
-def map_files(paths: List[str], parallelization: int) -> List[List[Dict[str, Union[str, int]]]]:
+def get_children_data(processes: List['Process']) -> None:
+    """
+    Recebe de cada filho, quando este termina, os dados dos ficheiros que processou e os tempos do processo
+    :param processes: Processos filhos
+    """
+    for received, (done, timings) in enumerate(messages(results, processes), 1):
+        for dados in done:
+            put_files_done(dados)
+        if done:
+            dic_process_timings[done[0]['pid']] = timings
+        if received == len(processes):
+            break
+
+def detect_compression(path: str) -> Union[str, None]:
+    """
+    Reconhece o formato de compressão de um ficheiro pelos seus primeiros bytes (ver COMPRESSION_MAGIC).
+    :param path: Caminho do ficheiro
+    :return: Formato de compressão, ou None se o ficheiro não for comprimido (ou não puder ser lido)
+    """
+    # Abrir um FIFO bloquearia até haver quem escreva
+    if not isfile(path):
+        return None
+
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(max(len(magic) for magic in COMPRESSION_MAGIC))
+    except OSError:
+        return None
+
+    for magic, compression in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+def is_binary(path: str, compression: str = None) -> bool:
+    """
+    Classifica um ficheiro como binário pelos primeiros SNIFF_SIZE bytes: se tiverem o byte NUL ou não forem UTF-8 válido
+    (uma sequência multibyte cortada no fim da amostra não conta como inválida).
+    :param path: Caminho do ficheiro
+    :param compression?: Formato de compressão. Quando especificado, é classificado o conteúdo descomprimido.
+    :return: Bool cujo True representa se o ficheiro é binário
+    """
+    if compression:
+        try:
+            with open_compressed(path, compression) as f:
+                sample = f.read(SNIFF_SIZE)
+        except compression_errors(compression):
+            # Ficheiro comprimido corrompido
+            return True
+    else:
+        with open(path, 'rb') as f:
+            sample = f.read(SNIFF_SIZE)
+
+    if b'\0' in sample:
+        return True
+
+    try:
+        getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+def skip_binary(path: str, compression: str = None) -> bool:
+    """
+    Verifica se um ficheiro é binário e, nesse caso, regista-o em binary_skipped.
+    :param path: Caminho do ficheiro
+    :param compression?: Formato de compressão (ver detect_compression)
+    :return: Bool cujo True representa se o ficheiro deve ser ignorado
+    """
+    try:
+        if not is_binary(path, compression):
+            return False
+        binary_skipped[path] = stat(path).st_size
+    except OSError:
+        # O erro é mostrado quando o ficheiro for dividido
+        return False
+    return True
+
+def file_ranges(path: str, size: int, done: Dict[str, List[Tuple[int, int]]] = None, compression: str = None) -> List[Tuple[str, int, int, str]]:
+    """
+    Intervalos de um ficheiro por pesquisar: o ficheiro inteiro, ou os intervalos entre os já pesquisados.
+    Um ficheiro comprimido é sempre pesquisado por inteiro (se ainda não tiver sido pesquisado).
+    :param path: Caminho do ficheiro
+    :param size: Tamanho do ficheiro em bytes
+    :param done?: Intervalos já pesquisados de cada ficheiro (ver load_checkpoint)
+    :param compression?: Formato de compressão (ver detect_compression)
+    :return: Lista de tuplos com o caminho, o início, o fim e a compressão de cada intervalo (ver chunks)
+    """
+    if compression:
+        return [] if done and path in done else [(path, 0, size, compression)]
+
+    ranges = []
+    start = 0
+    for done_start, done_end in sorted(done.get(path, [])) if done else []:
+        if done_start > start:
+            ranges.append((path, start, done_start, None))
+        start = max(start, done_end)
+    if size > start:
+        ranges.append((path, start, size, None))
+    return ranges
+
+def walk(roots: List[str], include: List[str] = None, exclude: List[str] = None, threads: int = 1) -> Generator[str, None, None]:
+    """
+    Percorre recursivamente as diretorias roots, com várias threads, e devolve os ficheiros à medida que são encontrados.
+    Com uma só thread, a ordem é determinística (em largura, e por ordem alfabética dentro de cada diretoria).
+    :param roots: Lista de Strings com o caminho das diretorias.
+    :param include?: Padrões (glob) do nome dos ficheiros a pesquisar. Por omissão, todos.
+    :param exclude?: Padrões (glob) do nome dos ficheiros e das diretorias a ignorar.
+    :param threads?: Quantidade de threads
+    :return: Gerador dos caminhos dos ficheiros.
+    """
+    dirs = ThreadQueue() # Diretorias por percorrer (None termina uma thread)
+    found = ThreadQueue() # Ficheiros encontrados (None quando já não há diretorias por percorrer)
+
+    def walker() -> None:
+        while True:
+            path = dirs.get()
+            if path is None:
+                break
+
+            try:
+                with scandir(path) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as err:
+                print(f'{Fore.LIGHTRED_EX}Diretoria {path}: {err}{Fore.RESET}')
+                entries = []
+
+            for entry in entries:
+                if exclude and any(fnmatch(entry.name, pattern) for pattern in exclude):
+                    continue
+                try:
+                    # As ligações simbólicas para diretorias não são seguidas (podem formar ciclos)
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.put(entry.path)
+                    elif entry.is_file() and (not include or any(fnmatch(entry.name, pattern) for pattern in include)):
+                        found.put(entry.path)
+                except OSError:
+                    pass
+
+            dirs.task_done()
+
+    def finish() -> None:
+        dirs.join()
+        for _ in range(threads):
+            dirs.put(None)
+        found.put(None)
+
+    for root in roots:
+        dirs.put(root)
+    for _ in range(threads):
+        Thread(target=walker, daemon=True).start()
+    Thread(target=finish, daemon=True).start()
+
+    while True:
+        path = found.get()
+        if path is None:
+            break
+        yield path
+
+def discover(paths: Iterable[str], task_size: int = None, cache_dir: str = None, done: Dict[str, List[Tuple[int, int]]] = None, ordered: List[Dict[str, Union[str, int]]] = None, binary_files: str = 'text') -> Generator[List[Dict[str, Union[str, int]]], None, None]:
+    """
+    Divide os ficheiros em parcelas à medida que os caminhos vão sendo dados (ver walk), em vez de dividir uma lista
+    completa (ver map_files). Os ficheiros grandes são divididos em parcelas de task_size bytes, e os pequenos são
+    juntos numa parcela até task_size bytes. Atualiza o dic_files_total.
+    :param paths: Caminhos dos ficheiros
+    :param task_size?: Tamanho (em bytes) de cada parcela. Por omissão, cada ficheiro é uma parcela.
+    :param cache_dir?: Diretoria dos índices de linhas. Quando especificada, as parcelas são ajustadas às linhas.
+    :param done?: Intervalos já pesquisados de cada ficheiro (ver load_checkpoint), que não são divididos.
+    :param ordered?: Lista onde é acrescentada cada parcela de ficheiro, pela ordem de seq (ver merge_lines)
+    :param binary_files?: Com 'skip', os ficheiros binários são ignorados (ver skip_binary). Por omissão, 'text'.
+    :return: Gerador das parcelas (ver chunks)
+    """
+    parcel = []
+    assigned = 0 # Bytes atribuídos à parcela atual
+    seq = len(ordered) if ordered is not None else 0
+    for path in paths:
+        # Ficheiros repetidos (e.g. dados com -f e encontrados com -r)
+        if path in dic_files_total or path in binary_skipped:
+            continue
+
+        # Antes de o abrir: uma diretoria não pode ser lida e abrir um FIFO bloquearia
+        try:
+            st = stat(path)
+        except OSError as err:
+            print(f'{Fore.LIGHTRED_EX}Ficheiro {path}: {err}{Fore.RESET}')
+            continue
+        if not S_ISREG(st.st_mode):
+            print(f'{Fore.LIGHTRED_EX}Ficheiro {path}: não encontrado ou inválido{Fore.RESET}')
+            continue
+        size = st.st_size
+
+        compression = detect_compression(path)
+        if binary_files == 'skip' and skip_binary(path, compression):
+            continue
+
+        file_chunks = []
+        for _, start, end, _ in file_ranges(path, size, done, compression):
+            # Os ficheiros comprimidos não são divididos
+            step = end - start if compression or not task_size else task_size
+            for chunk_start in range(start, end, step):
+                file_chunks.append({ 'path': path,
+                                     'file_id': len(dic_files_total),
+                                     'seq': 0,
+                                     'start': chunk_start,
+                                     'end': min(chunk_start + step, end),
+                                     'lines': 0 })
+                if compression:
+                    file_chunks[-1]['compression'] = compression
+        if not file_chunks:
+            continue
+
+        file_chunks[-1]['last'] = True
+        if cache_dir and not compression:
+            align_chunks([file_chunks], { path: load_index(path, cache_dir) }, { path: size })
+        dic_files_total[path] = len(file_chunks)
+
+        for file in file_chunks:
+            file['seq'] = seq
+            seq += 1
+            if ordered is not None:
+                ordered.append(file)
+
+            parcel.append(file)
+            assigned += file['end'] - file['start']
+            if task_size is None or assigned >= task_size:
+                yield parcel
+                parcel, assigned = [], 0
+
+    if parcel:
+        yield parcel
+
+def feed(queue: 'Queue', parcels: Iterable[List[Dict[str, Union[str, int]]]], parallelization: int, max_count: int = 0) -> None:
+    """
+    Coloca as parcelas na fila partilhada do escalonamento dinâmico, à medida que são criadas, seguidas de um None por filho.
+    :param queue: Fila partilhada
+    :param parcels: Parcelas (lista, ou gerador, ver discover)
+    :param parallelization: Quantidade de processos filhos
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas. 0 se não houver limite.
+    """
+    for parcel in parcels:
+        if stop or limit_reached(max_count):
+            break
+        queue.put(parcel)
+
+    for _ in range(parallelization):
+        queue.put(None)
+
+def map_files(paths: List[str], parallelization: int, cache_dir: str = None, task_size: int = None, done: Dict[str, List[Tuple[int, int]]] = None, binary_files: str = 'text') -> List[List[Dict[str, Union[str, int]]]]:
+    """
+    Divide os ficheiros pelos processos, segundo o seu tamanho (sem os ler).
+    :param paths: Lista de Strings com o caminho dos ficheiros.
+    :param parallelization: Quantidade de parcelas a dividir
+    :param cache_dir?: Diretoria dos índices de linhas. Quando especificada, as parcelas são ajustadas às linhas.
+    :param task_size?: Tamanho (em bytes) de cada parcela. Quando especificado, sobrepõe-se a parallelization.
+    :param done?: Intervalos já pesquisados de cada ficheiro (ver load_checkpoint), que não são divididos.
+    :param binary_files?: Com 'skip', os ficheiros binários são ignorados (ver skip_binary). Por omissão, 'text'.
+    :return: Lista das parcelas (ver chunks)
+    """
     global dic_files_total
-    files = [x for x in ((path, *file_lines_pos(path)) for path in paths) if x[1]]
-    total_lines = sum(f[1] for f in files)
+    files = []
+    sizes = {}
+    for path in paths:
+        # Antes de o abrir: uma diretoria não pode ser lida e abrir um FIFO bloquearia
+        try:
+            st = stat(path)
+        except OSError as err:
+            print(f'{Fore.LIGHTRED_EX}Ficheiro {path}: {err}{Fore.RESET}')
+            continue
+        if not S_ISREG(st.st_mode):
+            print(f'{Fore.LIGHTRED_EX}Ficheiro {path}: não encontrado ou inválido{Fore.RESET}')
+            continue
+        size = st.st_size
+
+        compression = detect_compression(path)
+        if binary_files == 'skip' and skip_binary(path, compression):
+            continue
 
-    chunked_files = chunks(files, total_lines, parallelization)
+        sizes[path] = size
+        files += file_ranges(path, size, done, compression)
+
+    total_size = sum(end - start for _, start, end, _ in files)
+    if task_size:
+        parallelization = max(ceil(total_size / task_size), 1)
+
+    chunked_files = chunks(files, total_size, parallelization)
+
+    if cache_dir:
+        align_chunks(chunked_files, { path: load_index(path, cache_dir) for path, _, _, compression in files if not compression }, sizes)
 
     # Atualizar o dic_files_total com os
     flat_files_total = [item for sublist in chunked_files for item in sublist]
@@ -520,28 +2024,85 @@ def map_files(paths: List[str], parallelization: int) -> List[List[Dict[str, Uni
 
     return chunked_files
 
-def init_threads(_interval: int = None, words: List[str] = None, all_words: bool = None, parallelization: int = None) -> None:
+def local_value(value: int) -> SimpleNamespace:
+    """
+    Equivalente local (sem memória partilhada) de um multiprocessing.Value, com value e get_lock.
+    :param value: Valor inicial
+    :return: Objeto com o valor e o Lock (de threads)
+    """
+    lock = ThreadLock()
+    return SimpleNamespace(value=value, get_lock=lambda: lock)
+
+def share(processes: bool) -> None:
     """
-    Inicia as threads de contagem de impressão ou receção de resultados
+    Cria os objetos partilhados pelo pai e pelos filhos (mutex, results, lines_done, children_active e matches_left).
+    Sem processos filhos, são criados equivalentes locais, e o multiprocessing não chega a ser importado.
+    :param processes: Se há processos filhos (ou o conjunto de processos do modo servidor)
+    """
+    global mutex, results, lines_done, children_active, matches_left
+
+    if processes:
+        from multiprocessing import Lock, Queue, Value
+
+        mutex, results, lines_done = Lock(), Queue(), Queue()
+        children_active, matches_left = Value('i', 0), Value('q', 0)
+    else:
+        mutex = ThreadLock()
+        children_active, matches_left = local_value(0), local_value(0)
+
+def shared_array(typecode: str, size: int, processes: bool, lock: bool = True) -> Union['Array', array]:
+    """
+    Cria um array de inteiros a zero, em memória partilhada apenas se houver processos filhos.
+    :param typecode: Tipo dos inteiros (e.g. 'q')
+    :param size: Quantidade de inteiros
+    :param processes: Se há processos filhos
+    :param lock?: Se o array partilhado tem Lock (ver get_lock). O array local não tem Lock.
+    :return: multiprocessing.Array, ou array local
+    """
+    if processes:
+        from multiprocessing import Array
+
+        return Array(typecode, size, lock=lock)
+    return array(typecode, bytes(size * array(typecode).itemsize))
+
+def total_size(paths: List[str]) -> int:
+    """
+    Tamanho total dos ficheiros, sem os ler (os que não existem contam como 0: o erro é mostrado na pesquisa).
+    :param paths: Lista de Strings com o caminho dos ficheiros.
+    :return: Tamanho total em bytes
+    """
+    total = 0
+    for path in paths:
+        try:
+            total += getsize(path)
+        except OSError:
+            pass
+    return total
+
+def init_threads(_interval: int = None, words: List[str] = None, all_words: bool = None) -> None:
+    """
+    Inicia a thread de impressão da contagem
     :param _interval: Intervalo de impressão de resultados
-    :param parallelization: Quantidade de processos filhos
-    :return:
     """
     # Thread de mostrar os resultados a cada interval segundos
     if _interval:
         thread_interval = Thread(target=interval, args=(_interval, words, all_words))
         thread_interval.start()
 
-    # Thread de receber os dados dos filhos
-    if parallelization:
-        thread_data = Thread(target=get_children_data)
-        thread_data.start()
-
 def main() -> None:
     """
     Processa e divide a pesquisa/contagem de ficheiros por processos (se aplicável).
     """
-    global dic_files_total
+    global dic_files_total, progress, files_left, spill_dir
+
+    # Modo servidor (não tem palavras nem ficheiros, logo é tratado antes do parser principal)
+    daemon_parser = ArgumentParser(add_help=False)
+    daemon_parser.add_argument('--daemon', type=str)
+    daemon_parser.add_argument('-p', '--parallelization', type=int, default=0)
+    daemon_args = daemon_parser.parse_known_args()[0]
+    if daemon_args.daemon:
+        serve(daemon_args.daemon, daemon_args.parallelization or cpu_count())
+        return
 
     # Prod -----
     args = parse()
@@ -562,52 +2123,210 @@ def main() -> None:
     # Quando o SIGINT (CTRL+C) é pressionado
     signal(SIGINT, sigint)
 
-    children_active.value = args['parallelization']
-    words = compile_words_regex(args['palavras'])
-    for i in range(len(words)):
-        total[i] = 0
+    matcher = compile_vocabulary() if args['top'] else compile_matcher(args['palavras'])
 
-    # Indexar
-    print(f'{Fore.LIGHTBLACK_EX}Indexing...{Style.RESET_ALL}')
-    files = map_files(args['files'], max(args['parallelization'], 1))
+    # Retomar uma execução interrompida: as parcelas já terminadas não são pesquisadas outra vez
+    recursive = bool(args['recursive'])
+    previous, done, previous_totals = load_checkpoint(args['output'], args, None if recursive else args['files']) if args['resume'] else ([], None, [])
+    if args['output']:
+        check_history(args['output'])
+
+    if args['profile']:
+        makedirs(args['profile'], exist_ok=True)
+
+    if args['index']:
+        make_index_dir(args['index'])
+
+    # Pesquisa rápida (ficheiros pequenos, ver FAST_PATH_SIZE): no próprio processo, sem indexação nem divisão.
+    # O tamanho de um ficheiro comprimido não diz quanto texto tem, logo estes nunca contam como pequenos.
+    # As opções --index e -s dynamic pedem a divisão dos ficheiros, logo também não usam a pesquisa rápida.
+    # Com a opção -p, a paralelização pedida é respeitada (e registada no histórico)
+    fast = (not recursive and not args['index'] and args['scheduler'] == 'static' and not args['parallelization']
+            and total_size(args['files']) <= FAST_PATH_SIZE
+            and not any(detect_compression(path) for path in args['files']))
+    share(args['parallelization'] > 0)
+
+    # Dividir
+    run_timings['indexing'] = 0.0
+    inicio = time()
+    # Com a opção -r, as parcelas são criadas à medida que os ficheiros são encontrados, logo o escalonamento é dinâmico
+    dynamic = (args['scheduler'] == 'dynamic' or recursive) and args['parallelization'] > 0
+    if fast:
+        # Cada ficheiro é uma parcela, criada apenas quando vai ser pesquisado
+        ordered = []
+        files = discover(args['files'], done=done, ordered=ordered, binary_files=args['binary_files'])
+        parallelization = 0
+        files_left = None
+    elif recursive:
+        print(f'{Fore.LIGHTBLACK_EX}Indexing...{Style.RESET_ALL}')
+        ordered = []
+        paths = chain(args['files'], walk(args['recursive'], args['include'], args['exclude'], 1 if args['print_lines'] else WALK_THREADS))
+        # A indexação acontece durante a pesquisa, à medida que as parcelas são pedidas
+        files = timed(discover(paths, args['task_size'] if dynamic else None, args['index'], done, ordered, args['binary_files']), run_timings, 'indexing')
+        parallelization = args['parallelization']
+        files_left = None
+    else:
+        print(f'{Fore.LIGHTBLACK_EX}Indexing...{Style.RESET_ALL}')
+        files = map_files(args['files'], max(args['parallelization'], 1), args['index'], args['task_size'] if dynamic else None, done, args['binary_files'])
+        ordered = sorted((file for parcel in files for file in parcel), key=lambda file: file['seq'])
+        # Podem existir menos parcelas que processos pedidos (e.g. ficheiros pequenos)
+        parallelization = args['parallelization'] if dynamic else min(args['parallelization'], len(files))
+
+        # Parcelas de cada ficheiro
+        files_left = shared_array('i', len(dic_files_total), args['parallelization'] > 0)
+        for file in ordered:
+            files_left[file['file_id']] += 1
+        run_timings['indexing'] = time() - inicio
+
+    # Quando parallelization é 0, o pai conta como o único processo ativo. Com a opção --follow, o pai conta
+    # também até ao fim do acompanhamento, para que a thread de impressão da contagem não termine com a pesquisa
+    children_active.value = max(parallelization, 1) + (1 if args['follow'] else 0)
 
-    init_threads(args['interval'], args['palavras'], args['all'], args['parallelization'])
+    # Uma linha de 64 bits por processo (ou apenas uma, do pai) na tabela de progresso, partilhada com os filhos
+    progress = shared_array('q', max(parallelization, 1) * (PROGRESS_WORDS + len(args['palavras'])), args['parallelization'] > 0, lock=False)
+
+    init_threads(args['interval'], args['palavras'], args['all'])
+    matches_left.value = args['max_count']
+
+    # Os filhos escrevem as linhas encontradas (ou, na opção --top, as tabelas de palavras) em ficheiros temporários,
+    # que o pai junta por ordem
+    if (args['print_lines'] and parallelization) or args['top']:
+        from tempfile import mkdtemp
+
+        spill_dir = mkdtemp(prefix='pgrepwc-')
 
     # Pesquisar
     print(f'{Fore.LIGHTBLACK_EX}Searching...{Style.RESET_ALL}')
+    run_timings['spawn'] = 0.0
+    inicio = time()
     # O pai faz a pesquisa e contagem quando parallelization é 0
     if not args['parallelization']:
-        process_files(files[0], words, args['all'], args['count'])
+        profiler = start_profile(args['profile'])
+        try:
+            for parcel in files:
+                for dados in process_files(parcel, 0, matcher, args['all'], args['count'], args['print_lines'], args['max_count']):
+                    put_files_done(dados)
+                if stop or limit_reached(args['max_count']):
+                    break
+        except BrokenPipeError:
+            broken_pipe()
+        if args['top']:
+            spill_vocabulary()
+        stop_profile(profiler, args['profile'])
+        dic_process_timings[getpid()] = process_timings
+        children_active.value -= 1
+    elif dynamic:
+        from multiprocessing import Process, Queue
+
+        # Fila partilhada com as tarefas (colocadas por uma thread, à medida que são criadas), seguidas de um None por filho
+        queue = Queue()
+        feeder = Thread(target=feed, args=(queue, files, parallelization, args['max_count']))
+
+        processos = [ Process(target=child, args=(queue, row, matcher, args['all'], args['count'], args['print_lines'], args['max_count'], args['profile'])) for row in range(parallelization) ]
+
+        for i in processos:
+            i.start()
+        feeder.start()
+        run_timings['spawn'] = time() - inicio
+
+        if args['print_lines']:
+            merge_lines(ordered, processos, args['count'], args['max_count'])
+
+        # Receber os dados dos filhos antes de esperar por eles (um filho só termina depois de os enviar)
+        get_children_data(processos)
+        for i in processos:
+            i.join()
+        feeder.join()
+
+        # Após um SIGINT podem sobrar tarefas na fila, que já não serão lidas
+        queue.cancel_join_thread()
     else:
+        from multiprocessing import Process
+
         processos = []
-        for child_files in files:
-            processos.append( Process(target=process_files, args=(child_files, words, args['all'], args['count'])) )
+        for row, child_files in enumerate(files):
+            processos.append( Process(target=child, args=(child_files, row, matcher, args['all'], args['count'], args['print_lines'], args['max_count'], args['profile'])) )
 
         for i in processos:
             i.start()
+        run_timings['spawn'] = time() - inicio
+
+        if args['print_lines']:
+            merge_lines(ordered, processos, args['count'], args['max_count'])
+
+        get_children_data(processos)
         for i in processos:
             i.join()
 
-    # A partir daqui os filhos estão todos mortos
-    # Imprimir total dos resultados
-    if len(args['files']) > 1:
+    # A partir daqui os filhos estão todos mortos (com a opção -n, as linhas foram juntas durante a pesquisa)
+    run_timings['search'] = time() - inicio - run_timings['spawn']
+    inicio = time()
+    if args['top']:
+        print_top(*top_words(args['top']))
+    run_timings['merge'] = time() - inicio
+
+    if spill_dir:
+        from shutil import rmtree
+
+        rmtree(spill_dir)
+
+    # Continuar a pesquisar o que for acrescentado aos ficheiros, a partir do fim do que já foi pesquisado
+    if args['follow'] and not stop:
+        ends = {}
+        for file in ordered:
+            ends[file['path']] = max(ends.get(file['path'], 0), file['end'])
+        for path, ranges in (done or {}).items():
+            ends[path] = max([ ends.get(path, 0) ] + [ end for _, end in ranges ])
+
+        lines = {}
+        for process in list(dic_files_done.values()) + [ p['files'] for p in previous ]:
+            for f in process:
+                f = f.get('file', f)
+                lines[f['path']] = lines.get(f['path'], 0) + f['lines']
+
+        states = []
+        # Com a opção -r, apenas os ficheiros encontrados durante a pesquisa (os comprimidos não são seguidos)
+        for file_id, path in enumerate(dict.fromkeys(path for path in chain(args['files'], dic_files_total)
+                                                     if path not in binary_skipped and not detect_compression(path))):
+            try:
+                inode = stat(path).st_ino
+            except OSError:
+                inode = None
+            states.append({ 'path': path, 'file_id': file_id, 'inode': inode, 'offset': ends.get(path, 0), 'lines': lines.get(path, 0) })
+
+        try:
+            follow(states, matcher, args['all'], args['count'], args['print_lines'], args['max_count'])
+        except BrokenPipeError:
+            broken_pipe()
+
+    # Termina a thread de impressão da contagem (ver children_active)
+    children_active.value = 0
+
+    # Imprimir total dos resultados (incluindo os do histórico retomado)
+    if (len(args['files']) > 1 or recursive or args['resume']) and not args['print_lines'] and not args['top']:
         print(f'{Fore.LIGHTRED_EX}Total{" até ao momento" if stop else ""}:{Style.RESET_ALL}')
         # A partir do Python 3.7 os dicionários são ordenados, portanto pode-se usar a lista inicial das palavras
-        print_results(args['palavras'], args['all'], args['count'])
+        totals = sum_totals(len(args['palavras']))
+        print_results(args['palavras'], args['all'], args['count'], [ a + b for a, b in zip(totals, previous_totals) ] if previous_totals else totals)
+    print_skipped()
 
     # Escrever para fichiro binário
     if args['output']:
         output(args['output'],
+               args['palavras'],
                to_micro(inicio_execucao),
                to_micro(time()-inicio_execucao),
                args['parallelization'],
                args['all'],
                args['count'],
-               args['interval'])
+               args['interval'],
+               previous)
 
-def output(path: str, start: int, duration: int, parallelization: int, all_words: bool, count: int, _interval: int) -> None:
+def output(path: str, words: Tuple[str], start: int, duration: int, parallelization: int, all_words: bool, count: int, _interval: int, previous: List[Dict] = None) -> None:
     """
-    Escrever os resultados de execução para um ficheiro binário
+    Acrescentar os resultados de execução ao histórico, um ficheiro binário com uma execução por segmento (ver historico.py).
+    O histórico guarda o intervalo (em bytes) de cada parcela terminada, e serve de ponto de retoma (ver load_checkpoint),
+    e os tempos de cada fase da execução (ver run_timings), de cada processo (ver dic_process_timings) e de cada parcela.
     :param path: Caminho do ficheiro onde escrever
     :param words: Palavras pesquisadas
     :param start: UNIX timestamp do início de execução
@@ -616,37 +2335,330 @@ def output(path: str, start: int, duration: int, parallelization: int, all_words
     :param all_words: Se a opção -a está ativa
     :param count: Se a opção -c está ativa
     :param interval: Intervalo de escrita de mensagens
+    :param previous?: Processos do histórico retomado (ver load_checkpoint), escritos antes dos desta execução
     """
     out = {
+        'resumed': bool(previous),
         'start': start,
         'duration': duration,
         'children': parallelization,
         'all': all_words,
         'count': count,
         'interval': _interval,
-        'processes': []
+        'words': list(words),
+        'files': {},
+        'binary_skipped': list(binary_skipped),
+        'timings': { phase: to_micro(t) for phase, t in run_timings.items() },
+        'processes': list(previous or [])
     }
 
     for p_files in dic_files_done:
         process = {
             'pid': p_files,
+            'timings': { phase: to_micro(t) for phase, t in dic_process_timings.get(p_files, {}).items() },
             'files': []
         }
 
         for f in dic_files_done[p_files]:
             process['files'].append({
                 'path': f['file']['path'],
+                'start': f['file']['start'],
+                'end': f['file']['end'],
+                'complete': not f['file'].get('partial'),
                 'duration': to_micro(f['duration']),
+                'timings': { phase: to_micro(t) for phase, t in f['file'].get('timings', {}).items() },
                 'lines': f['file']['lines'],
                 'occurrences': f['occurrences']
             })
         out['processes'].append(process)
 
-    with open(path, 'wb') as file:
-        dump(out, file)
+    # Tamanho e data de modificação de cada ficheiro, para validar a retoma
+    for process in out['processes']:
+        for f in process['files']:
+            if f['path'] not in out['files']:
+                try:
+                    st = stat(f['path'])
+                    out['files'][f['path']] = [st.st_size, st.st_mtime_ns]
+                except OSError:
+                    pass
+
+    append_run(path, out)
+
+def load_checkpoint(path: str, args: Dict[str, Union[str, int, bool, Tuple[str]]], paths: List[str]) -> Tuple[List[Dict], Dict[str, List[Tuple[int, int]]], List[int]]:
+    """
+    Lê a última execução do histórico (escrito com a opção -o), interrompida, para a retomar (opção --resume).
+    Apenas as parcelas terminadas dos ficheiros pedidos são aproveitadas.
+    :param path: Caminho do histórico
+    :param args: Argumentos da execução atual, que têm de ter as mesmas palavras e opções -a e -c/-l
+    :param paths: Caminhos dos ficheiros pedidos (tal como guardados no histórico). None para aproveitar todos (opção -r).
+    :return: Tuplo com os processos do histórico (só com as parcelas aproveitadas), os intervalos já pesquisados
+             de cada ficheiro e os totais já contados
+    """
+    try:
+        history = last_run(path)
+    except OSError as err:
+        raise UserWarning(f'Argument --resume: cannot read checkpoint {path} ({err}).')
+
+    if history is None:
+        raise UserWarning(f'Argument --resume: {path} has no runs.')
+
+    if tuple(history['words']) != tuple(args['palavras']) or history['all'] != args['all'] or history['count'] != args['count']:
+        raise UserWarning('Argument --resume requires the same words and -a, -c/-l options as the checkpoint.')
+
+    processes = []
+    done = {}
+    totals = []
+    for process in history['processes']:
+        files = []
+        for f in process['files']:
+            if (paths is not None and f['path'] not in paths) or not f.get('complete', True):
+                continue
+
+            # O ficheiro não pode ter mudado desde o histórico
+            try:
+                st = stat(f['path'])
+            except OSError:
+                continue
+            if history['files'].get(f['path']) != [st.st_size, st.st_mtime_ns]:
+                raise UserWarning(f'Argument --resume: file {f["path"]} changed since the checkpoint.')
+
+            files.append(f)
+            done.setdefault(f['path'], []).append((f['start'], f['end']))
+            totals = [ a + b for a, b in zip(totals, f['occurrences']) ] if totals else list(f['occurrences'])
+
+        if files:
+            processes.append({ 'pid': process['pid'], 'timings': process['timings'], 'previous': True, 'files': files })
+
+    return processes, done, totals
+
+def search_parcel(files: List[Dict[str, Union[str, int]]], matcher: Matcher, all_words: bool, count: bool, cwd: str, lines_dir: str = None, max_count: int = 0) -> List[Dict]:
+    """
+    Pesquisa/conta dadas palavras numa parcela, num processo do conjunto do modo servidor.
+    :param files: Parcela (lista de ficheiros, ver chunks).
+    :param matcher: Motor de pesquisa (criado por compile_matcher) com as palavras a pesquisar/contar.
+    :param all_words: Bool cujo True representa se a pesquisa/contagem deve apenas
+                      com todas as palavras dadas.
+    :param count: Bool cujo True representa se é impressa a quantidade de ocorrências
+                  e cujo False a quantidade de linhas.
+    :param cwd: Diretoria de trabalho do cliente, onde são abertos os caminhos relativos (ver handle_request).
+    :param lines_dir?: Diretoria onde escrever as linhas encontradas em cada parcela (ver spill_dir).
+    :param max_count?: Limite global de linhas (ou ocorrências, com -c) encontradas. 0 se não houver limite.
+    :return: Lista dos dados do processamento de cada ficheiro (ver dic_files_done)
+    """
+    chdir(cwd)
+
+    res = []
+    for file in files:
+        if limit_reached(max_count):
+            break
+
+        inicio = time()
+        try:
+            if lines_dir is None:
+                occurrences = count_file(file, matcher, all_words, count, max_count=max_count)
+            else:
+                with open(join(lines_dir, str(file['seq'])), 'w', encoding='utf-8', newline='\n') as spill:
+                    occurrences = count_file(file, matcher, all_words, count, spill, max_count=max_count)
+        except OSError as err:
+            # Como em process_files, a parcela fica por pesquisar; o erro é escrito para o cliente (ver search_request)
+            occurrences = [0] * (1 if all_words and not count else len(matcher['words']))
+            file['partial'] = True
+            file['error'] = str(err)
+
+        res.append({
+            'pid': getpid(),
+            'file': file,
+            'duration': time() - inicio,
+            'occurrences': occurrences
+        })
+    return res
+
+def handle_request(pool: 'Pool', workers: int, argv: List[str], cwd: str, color: bool = False) -> None:
+    """
+    Executa um pedido de pesquisa no modo servidor, escrevendo para o stdout o mesmo que o pgrepwc.
+    :param pool: Conjunto de processos sempre ativos.
+    :param workers: Quantidade de processos do conjunto.
+    :param argv: Argumentos do pedido (os mesmos do pgrepwc).
+    :param cwd: Diretoria de trabalho do cliente. Os caminhos são mostrados e guardados no histórico tal como
+                foram dados (como no pgrepwc), e apenas são abertos a partir desta diretoria.
+    :param color?: Bool cujo True representa se o stdout do cliente é um terminal, i.e. se a resposta tem cores.
+    """
+    global Fore, Style
+    previous_colors = Fore, Style
+    if color:
+        from colorama import Fore, Style
+    else:
+        Fore, Style = PLAIN_FORE, PLAIN_STYLE
+
+    previous_cwd = getcwd()
+    chdir(cwd)
+    try:
+        search_request(pool, workers, argv, cwd)
+    finally:
+        chdir(previous_cwd)
+        Fore, Style = previous_colors
+
+def search_request(pool: 'Pool', workers: int, argv: List[str], cwd: str) -> None:
+    """
+    Executa um pedido de pesquisa no modo servidor, já na diretoria de trabalho do cliente (ver handle_request).
+    :param pool: Conjunto de processos sempre ativos.
+    :param workers: Quantidade de processos do conjunto.
+    :param argv: Argumentos do pedido (os mesmos do pgrepwc).
+    :param cwd: Diretoria de trabalho do cliente, enviada aos processos do conjunto.
+    """
+    global dic_files_done, dic_files_total, binary_skipped, inicio_execucao, spill_dir
+    inicio_execucao = time()
+    dic_files_done = {}
+    dic_files_total = {}
+    binary_skipped = {}
+
+    args = parse(argv, stdin=False)
+    if args['follow'] or args['top'] or args['profile']:
+        raise UserWarning('Arguments --follow, --top and --profile are not supported in daemon mode.')
+
+    # Sem a opção -p, os ficheiros são divididos por todos os processos do conjunto (no máximo um por ficheiro, como no pgrepwc)
+    if not args['parallelization']:
+        args['parallelization'] = workers if args['recursive'] else min(workers, len(args['files']))
+
+    files = args['files']
+    words = args['palavras']
+    matcher = compile_matcher(words)
+
+    print(f'{Fore.LIGHTBLACK_EX}Indexing...{Style.RESET_ALL}')
+    dynamic = args['scheduler'] == 'dynamic'
+    cache_dir = make_index_dir(args['index']) if args['index'] else None
+    previous, done, previous_totals = load_checkpoint(args['output'], args, None if args['recursive'] else files) if args['resume'] else ([], None, [])
+    if args['output']:
+        check_history(args['output'])
+    if args['recursive']:
+        # As parcelas são enviadas para o conjunto de processos à medida que os ficheiros são encontrados
+        parcels = discover(chain(files, walk(args['recursive'], args['include'], args['exclude'], 1 if args['print_lines'] else WALK_THREADS)), args['task_size'], cache_dir, done, binary_files=args['binary_files'])
+    else:
+        parcels = map_files(files, max(args['parallelization'], 1), cache_dir, args['task_size'] if dynamic else None, done, args['binary_files'])
+
+    print(f'{Fore.LIGHTBLACK_EX}Searching...{Style.RESET_ALL}')
+    totals = previous_totals or [0] * len(words)
+    # O contador partilhado foi herdado pelos processos do conjunto quando este foi criado
+    matches_left.value = args['max_count']
+    if args['print_lines']:
+        # As parcelas são recebidas pela ordem em que foram enviadas (imap), logo as linhas são escritas por ordem
+        from tempfile import mkdtemp
+
+        spill_dir = mkdtemp(prefix='pgrepwc-')
+        search = pool.imap(partial(search_parcel, matcher=matcher, all_words=args['all'], count=args['count'], cwd=cwd, lines_dir=spill_dir, max_count=args['max_count']), parcels)
+    else:
+        search = pool.imap_unordered(partial(search_parcel, matcher=matcher, all_words=args['all'], count=args['count'], cwd=cwd, max_count=args['max_count']), parcels)
+
+    # Se o cliente desligar a meio (ou a pesquisa falhar), as linhas por escrever são apagadas na mesma
+    try:
+        base, file_id = 0, None
+        for done in search:
+            for dados in done:
+                put_files_done(dados)
+                for i, val in enumerate(dados['occurrences']):
+                    totals[i] += val
+
+                if dados['file'].get('error'):
+                    print(f'{Fore.LIGHTRED_EX}Ficheiro {dados["file"]["path"]}: {dados["file"]["error"]}{Fore.RESET}')
+                    if not args['print_lines']:
+                        continue
+
+                if args['print_lines']:
+                    if dados['file']['file_id'] != file_id:
+                        base, file_id = 0, dados['file']['file_id']
+                    # Com a opção --index, o número da primeira linha da parcela já é conhecido (ver align_chunks)
+                    if dados['file'].get('line') is not None:
+                        base = dados['file']['line']
+
+                    # Depois de uma parcela que ficou a meio (opção -m), sem a opção --index, o número das linhas seguintes do mesmo ficheiro não é conhecido
+                    if base is None or limit_reached(args['max_count']):
+                        unlink_spill(dados['file'])
+                        continue
+
+                    print_spill(dados['file'], base, args['count'], args['max_count'])
+                    base = None if dados['file'].get('partial') else base + dados['file']['lines']
+                else:
+                    print(f'{Fore.LIGHTMAGENTA_EX}Ficheiro {dados["file"]["path"]}:{Style.RESET_ALL}')
+                    print_results(words, args['all'], args['count'], dados['occurrences'])
+    finally:
+        if spill_dir:
+            from shutil import rmtree
+
+            rmtree(spill_dir)
+            spill_dir = None
+
+    if (len(files) > 1 or args['recursive'] or args['resume']) and not args['print_lines']:
+        print(f'{Fore.LIGHTRED_EX}Total:{Style.RESET_ALL}')
+        print_results(words, args['all'], args['count'], totals)
+    print_skipped()
+
+    if args['output']:
+        output(args['output'],
+               words,
+               to_micro(inicio_execucao),
+               to_micro(time()-inicio_execucao),
+               args['parallelization'],
+               args['all'],
+               args['count'],
+               args['interval'],
+               previous)
+
+def serve(path: str, workers: int) -> None:
+    """
+    Modo servidor: mantém um conjunto de processos sempre ativos e atende pedidos de pesquisa
+    (um de cada vez) no socket Unix path. Cada pedido é uma linha JSON com os argumentos ('argv'), a diretoria
+    de trabalho ('cwd') e se o stdout do cliente é um terminal ('color'); a resposta é o texto que o pgrepwc
+    escreveria.
+    :param path: Caminho do socket Unix.
+    :param workers: Quantidade de processos do conjunto.
+    """
+    from multiprocessing import Pool
+    from socket import socket, AF_UNIX, SOCK_STREAM
+    from json import loads
+
+    if exists(path):
+        unlink(path)
+
+    # O contador partilhado da opção -m é herdado pelos processos do conjunto quando este é criado
+    share(True)
+
+    # O SIGINT (CTRL+C) termina apenas o servidor, que termina o conjunto de processos
+    with Pool(workers, initializer=signal, initargs=(SIGINT, SIG_IGN)) as pool, socket(AF_UNIX, SOCK_STREAM) as server:
+        server.bind(path)
+        server.listen()
+
+        # O SIGTERM termina o servidor tal como o SIGINT
+        signal(SIGTERM, default_int_handler)
+        print(f'{Fore.LIGHTBLACK_EX}A aguardar pedidos em {path} ({workers} processos)...{Style.RESET_ALL}')
+
+        try:
+            while True:
+                conn, _ = server.accept()
+                try:
+                    with conn, conn.makefile('r', encoding='utf-8') as reader, conn.makefile('w', encoding='utf-8') as writer:
+                        request = loads(reader.readline())
+                        with redirect_stdout(writer), redirect_stderr(writer):
+                            try:
+                                handle_request(pool, workers, request['argv'], request['cwd'], request.get('color', False))
+                            except UserWarning as w:
+                                print(w)
+                            except SystemExit:
+                                # Erros (ou -h) do parser de argumentos
+                                pass
+                except Exception as err:
+                    # Um pedido inválido, ou um cliente que desliga a meio da resposta (BrokenPipeError),
+                    # não termina o servidor
+                    print(f'{Fore.LIGHTRED_EX}Pedido falhado: {err!r}{Fore.RESET}')
+        except KeyboardInterrupt:
+            pass
+        finally:
+            unlink(path)
 
 if __name__ == '__main__':
     try:
         main()
     except UserWarning as w:
         print(w)
+    except BrokenPipeError:
+        # e.g. pgrepwc ... | head, fora da escrita das linhas encontradas (ver broken_pipe)
+        sys.stderr.close()